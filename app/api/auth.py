@@ -1,18 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from pydantic import BaseModel
+import logging
 
 from app.database import get_db
 from app.models.user import User
 from app.services.auth import (
-    get_password_hash,
-    verify_password,
+    hash_password_async,
+    verify_password_async,
     create_access_token,
     ACCESS_TOKEN_EXPIRE_MINUTES,
-    get_current_user
+    get_current_user,
+    token_user_cache
 )
 
 class UserRegister(BaseModel):
@@ -20,6 +23,8 @@ class UserRegister(BaseModel):
     email: str
     password: str
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
@@ -42,26 +47,26 @@ async def register_page(request: Request):
 @router.post("/register")
 async def register(
     user_data: UserRegister,  # Update to use Pydantic model
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    print(f"Received registration request for username: {user_data.username}")  # Debug print
+    logger.info("Registration request", extra={"user": user_data.username})
     
     # Check if username already exists
-    if db.query(User).filter(User.username == user_data.username).first():
+    if (await db.execute(select(User.id).where(User.username == user_data.username))).first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
     # Check if email already exists
-    if db.query(User).filter(User.email == user_data.email).first():
+    if (await db.execute(select(User.id).where(User.email == user_data.email))).first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
 
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password_async(user_data.password)
     user = User(
         username=user_data.username,
         email=user_data.email,
@@ -70,11 +75,11 @@ async def register(
     
     try:
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     except Exception as e:
-        print(f"Database error: {str(e)}")  # Debug print
-        db.rollback()
+        logger.error("Database error: %s", e)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -95,16 +100,26 @@ async def register(
 @router.post("/token")  # Changed back to /token endpoint
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Authenticate user
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    result = await db.execute(select(User).where(User.username == form_data.username))
+    user = result.scalar_one_or_none()
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await verify_password_async(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
         )
 
+    # Transparently upgrade hashes made with an outdated cost factor
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        token_user_cache.invalidate_user(user.username)
+
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -1,38 +1,137 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from sqlalchemy.orm import Session
-import traceback
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import json
+import logging
 
-from app.database import get_db
+from app.config import settings
+from app.database import get_db, SessionLocal
 from app.services.auth import get_current_user
-from app.services.llm import llm_service, get_llm_response
+from app.services.llm import GenerationTimeout, llm_service, get_llm_response
+from app.services.context import PromptTooLong
+from app.services.generation import FinishReason, GenerationStats
+from app.services.fair_share import QuotaExceeded
+from app.services.inference import QueueFullError
+from app.services.response_cache import is_deterministic
+from app.services.summarizer import conversation_summarizer
+from app.services.message_writer import message_writer
+from app.services.search import search_messages
 from app.services.chat import (
     create_new_chat,
-    add_message_to_chat,
     get_chat_history,
+    get_chat_messages_page,
     get_user_chats,
     get_chat
 )
 from app.models.user import User
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Page sizes for the chat and message listings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# How often a waiting request checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
+class ClientDisconnected(Exception):
+    """The client went away before its response was ready"""
+
 class ChatRequest(BaseModel):
     message: str
     model: str
     chat_id: Optional[int] = None
+    temperature: float = Field(0.7, ge=0.0, le=2.0)
+    seed: Optional[int] = None
+    allow_cached: bool = False  # Accept a cached answer even when sampling is random
+
+    def sampling(self) -> dict:
+        sampling = {"temperature": self.temperature}
+        if self.seed is not None:
+            sampling["seed"] = self.seed
+        return sampling
+
+def _use_response_cache(request: ChatRequest, cache_control: Optional[str]) -> bool:
+    """Cached answers are only used for deterministic sampling or when the
+    client opts in, and never with `Cache-Control: no-cache`"""
+    if cache_control and "no-cache" in cache_control.lower():
+        return False
+    return request.allow_cached or is_deterministic(request.sampling())
+
+def _format_history(history, use_token_counts: bool) -> List[dict]:
+    """Convert history rows for the LLM service.
+
+    Stored token counts are only valid for the chat's own model.
+    """
+    return [
+        {
+            "user_message": msg.user_message,
+            "assistant_response": msg.assistant_response,
+            "token_count": msg.token_count if use_token_counts else None
+        }
+        for msg in history
+    ]
+
+async def _cancel_on_disconnect(http_request: Request, awaitable):
+    """Await awaitable, cancelling it if the client disconnects first.
+
+    Starlette only notices a disconnect when it tries to send, so without
+    this a generation nobody will read runs to the end.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+def _quota_exceeded(user: User, error: QuotaExceeded) -> HTTPException:
+    logger.info("Token quota exceeded, rejecting request", extra={"user": user.username})
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="You have used your share of the model for now. Please try again shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+PROMPT_TOO_LONG_DETAIL = "Your message is too long for this model. Please shorten it."
+
+def _new_token_counts(history, history_formatted: List[dict], use_token_counts: bool) -> dict:
+    """Token counts the LLM service computed for messages that had none stored"""
+    if not use_token_counts:
+        return {}
+    return {
+        msg.id: item["token_count"]
+        for msg, item in zip(history, history_formatted)
+        if msg.token_count is None and item["token_count"] is not None
+    }
 
 @router.post("/chat")
 async def chat(
     request: ChatRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    cache_control: Optional[str] = Header(None)
 ):
     try:
-        print(f"[Chat] Received request from user {current_user.username}")
-        print(f"[Chat] Message: {request.message}")
-        print(f"[Chat] Selected model: {request.model}")
+        logger.info(
+            "Chat request",
+            extra={
+                "user": current_user.username,
+                "model": request.model,
+                "chat_id": request.chat_id,
+                "user_message": request.message
+            }
+        )
 
         # Get or create chat
         if request.chat_id:
@@ -42,85 +141,297 @@ async def chat(
         else:
             chat = await create_new_chat(db, current_user.id, request.model)
 
-        # Get chat history
-        history = await get_chat_history(db, chat.id)
-        history_formatted = [
-            {
-                "user_message": msg.user_message,
-                "assistant_response": msg.assistant_response
-            }
-            for msg in history
-        ]
+        # Get the history after the chat's summary, including messages still being saved
+        await message_writer.sync(chat.id)
+        history = await get_chat_history(db, chat.id, settings.CHAT_HISTORY_WINDOW, chat.summary_message_id)
+        use_token_counts = chat.model_name == request.model
+        history_formatted = _format_history(history, use_token_counts)
 
-        # Generate response with timeout protection
+        # Generate the response; it stops at the model's deadline or when the client leaves
+        stats = GenerationStats()
         try:
-            response = await get_llm_response(request.message, request.model, history_formatted)
+            response = await _cancel_on_disconnect(http_request, get_llm_response(
+                request.message,
+                request.model,
+                history_formatted,
+                chat.id,
+                sampling=request.sampling(),
+                use_cache=_use_response_cache(request, cache_control),
+                summary=chat.summary,
+                stats=stats,
+                user_id=current_user.id
+            ))
+        except ClientDisconnected:
+            logger.info("Client disconnected, generation cancelled", extra={"chat_id": chat.id})
+            raise HTTPException(status_code=499, detail="Client closed request")
+        except GenerationTimeout as e:
+            logger.warning("Generation timed out: %s", e)
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="The model took too long to respond. Please try again."
+            )
+        except QuotaExceeded as e:
+            raise _quota_exceeded(current_user, e)
+        except QueueFullError as e:
+            logger.warning("Inference queue full, rejecting request", extra={"queue_depth": e.queue_depth})
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Model is busy. Please try again shortly.",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        except PromptTooLong:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=PROMPT_TOO_LONG_DETAIL)
         except Exception as e:
-            print(f"[Chat] Model response error: {str(e)}")
+            logger.error("Model response error: %s", e)
             raise HTTPException(
                 status_code=500,
                 detail="Failed to generate response. Please try again."
             )
 
-        # Save message and response
+        # Save message and response, plus any newly computed token counts
+        new_token_counts = _new_token_counts(history, history_formatted, use_token_counts)
         try:
-            await add_message_to_chat(db, chat.id, request.message, response)
+            await message_writer.save(
+                db, chat.id, request.message, response, stats.finish_reason, new_token_counts
+            )
+            conversation_summarizer.schedule(chat.id)
         except Exception as e:
-            print(f"[Chat] Database error: {str(e)}")
+            logger.error("Database error: %s", e)
             # Still return the response even if saving fails
             pass
 
         return {
             "response": response,
-            "chat_id": chat.id
+            "chat_id": chat.id,
+            "finish_reason": stats.finish_reason,
+            "partial": stats.partial
         }
 
     except HTTPException as http_error:
         raise http_error
     except Exception as e:
-        print(f"[Chat] Unexpected error: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Unexpected error")
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 
-@router.get("/chats", response_model=List[dict])
-async def get_chats(
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Encode a server-sent event"""
+    lines = f"event: {event}\n" if event else ""
+    return f"{lines}data: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    cache_control: Optional[str] = Header(None)
 ):
-    """Get all chats for the current user"""
-    chats = await get_user_chats(db, current_user.id)
-    return [
-        {
-            "id": chat.id,
-            "title": chat.title,
-            "model": chat.model_name,
-            "updated_at": chat.updated_at
+    """Stream the response as server-sent events while it is generated"""
+    logger.info(
+        "Streaming chat request",
+        extra={
+            "user": current_user.username,
+            "model": request.model,
+            "chat_id": request.chat_id,
+            "user_message": request.message
         }
-        for chat in chats
-    ]
+    )
+
+    # Get or create chat
+    if request.chat_id:
+        chat = await get_chat(db, request.chat_id)
+        if not chat or chat.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Chat not found")
+    else:
+        chat = await create_new_chat(db, current_user.id, request.model)
+    chat_id = chat.id
+    use_token_counts = chat.model_name == request.model
+
+    # Get the history after the chat's summary, including messages still being saved
+    await message_writer.sync(chat_id)
+    history = await get_chat_history(db, chat_id, settings.CHAT_HISTORY_WINDOW, chat.summary_message_id)
+    history_formatted = _format_history(history, use_token_counts)
+
+    # Queue the generation now so a full queue or missing model is reported
+    # as a proper HTTP error instead of a broken stream
+    stats = GenerationStats()
+    try:
+        chunks = await llm_service.stream_response(
+            request.message,
+            request.model,
+            history_formatted,
+            chat_id,
+            sampling=request.sampling(),
+            use_cache=_use_response_cache(request, cache_control),
+            summary=chat.summary,
+            stats=stats,
+            user_id=current_user.id
+        )
+    except QuotaExceeded as e:
+        raise _quota_exceeded(current_user, e)
+    except QueueFullError as e:
+        logger.warning("Inference queue full, rejecting request", extra={"queue_depth": e.queue_depth})
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is busy. Please try again shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        logger.error("Model response error: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to generate response. Please try again."
+        )
+
+    async def event_stream():
+        parts = []
+        try:
+            yield _sse_event({"chat_id": chat_id}, event="start")
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield _sse_event({"token": chunk})
+        except PromptTooLong:
+            # The prompt is only built on the inference worker, after the
+            # response has started, so the status goes in the event
+            yield _sse_event({"detail": PROMPT_TOO_LONG_DETAIL, "status": 413}, event="error")
+            return
+        except Exception as e:
+            logger.error("Streaming error: %s", e)
+            yield _sse_event({"detail": "Failed to generate response. Please try again."}, event="error")
+            return
+        finally:
+            # When the client disconnects this generator is closed, and the
+            # generation with it
+            await chunks.aclose()
+
+        response = "".join(parts).strip()
+        if not response and stats.finish_reason == FinishReason.DEADLINE:
+            logger.warning("Generation timed out", extra={"chat_id": chat_id})
+            yield _sse_event({"detail": "The model took too long to respond. Please try again."}, event="error")
+            return
+
+        # Save message and response once the stream has finished. The request
+        # session is already closed by now, so use a fresh one.
+        new_token_counts = _new_token_counts(history, history_formatted, use_token_counts)
+        async with SessionLocal() as stream_db:
+            try:
+                await message_writer.save(
+                    stream_db, chat_id, request.message, response, stats.finish_reason, new_token_counts
+                )
+                conversation_summarizer.schedule(chat_id)
+            except Exception as e:
+                logger.error("Database error: %s", e)
+
+        yield _sse_event({
+            "chat_id": chat_id,
+            "response": response,
+            "finish_reason": stats.finish_reason,
+            "partial": stats.partial
+        }, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/chats")
+async def get_chats(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the current user's chats, most recently updated first.
+
+    Pass the returned `next_cursor` back as `cursor` for the next page.
+    """
+    try:
+        chats, next_cursor = await get_user_chats(db, current_user.id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "chats": [
+            {
+                "id": chat.id,
+                "title": chat.title,
+                "model": chat.model_name,
+                "updated_at": chat.updated_at
+            }
+            for chat in chats
+        ],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/chats/search")
+async def search_chats(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=10000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Search the current user's messages, best match first.
+
+    Every word must match; the last one also matches as a prefix. Pass the
+    returned `next_offset` back as `offset` for the next page.
+    """
+    try:
+        results, next_offset = await search_messages(db, current_user.id, q, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return {
+        "results": [
+            {
+                "message_id": row.id,
+                "chat_id": row.chat_id,
+                "chat_title": row.chat_title,
+                "model": row.model_name,
+                "snippet": row.snippet,
+                "created_at": row.created_at.isoformat()
+            }
+            for row in results
+        ],
+        "next_offset": next_offset
+    }
 
 @router.get("/chats/{chat_id}/messages")
 async def get_chat_messages(
     chat_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get messages for a specific chat"""
+    """Get messages for a specific chat, most recent page first.
+
+    Messages in a page are in chronological order. Pass the returned
+    `next_cursor` back as `cursor` for the page of older messages.
+    """
     chat = await get_chat(db, chat_id)
     if not chat or chat.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    messages = await get_chat_history(db, chat_id)
-    print(f"[Chat] Retrieved {len(messages)} messages for chat {chat_id}")  # Debug log
+    await message_writer.sync(chat_id)
+    try:
+        messages, next_cursor = await get_chat_messages_page(db, chat_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.debug("Retrieved %d messages for chat %d", len(messages), chat_id)
     
-    return [
-        {
-            "user_message": msg.user_message,
-            "assistant_response": msg.assistant_response,
-            "created_at": msg.created_at.isoformat()  # Format date for JSON
-        }
-        for msg in messages
-    ]
\ No newline at end of file
+    return {
+        "messages": [
+            {
+                "user_message": msg.user_message,
+                "assistant_response": msg.assistant_response,
+                "finish_reason": msg.finish_reason,
+                "created_at": msg.created_at.isoformat()  # Format date for JSON
+            }
+            for msg in messages
+        ],
+        "next_cursor": next_cursor
+    }
\ No newline at end of file
@@ -1,4 +1,6 @@
+import json
 import os
+import socket
 from pathlib import Path
 from typing import Dict, Any
 from dotenv import load_dotenv
@@ -7,6 +9,19 @@ from dotenv import load_dotenv
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Model settings the tuning file may override
+TUNED_MODEL_KEYS = ("threads", "batch_size")
+
+def read_model_tuning(path: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Read a model tuning file: {host name: {model id: settings}}, empty if missing"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)["hosts"]
+    except (ValueError, KeyError) as e:
+        raise ValueError(f"Invalid model tuning file {path}: {e}")
+
 class Settings:
     # Environment
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
@@ -22,14 +37,97 @@ class Settings:
     
     # Database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./lemtosh.db")
+    DATABASE_POOL_SIZE: int = int(os.getenv("DATABASE_POOL_SIZE", 5))
+    DATABASE_MAX_OVERFLOW: int = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+    # SQLite connection tuning (ignored for other databases); empty to keep SQLite's default
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    SQLITE_MMAP_SIZE_MB: float = float(os.getenv("SQLITE_MMAP_SIZE_MB", 256))
+
+    # Write-behind: queue chat messages and save them in group commits, so
+    # responses don't wait for the disk. Queued messages are lost on a crash.
+    WRITE_BEHIND_ENABLED: bool = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+    WRITE_BEHIND_MAX_BATCH: int = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 64))  # messages per commit
+    WRITE_BEHIND_FLUSH_MS: int = int(os.getenv("WRITE_BEHIND_FLUSH_MS", 50))  # longest a message waits
+    WRITE_BEHIND_QUEUE_SIZE: int = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", 1000))
     
     # JWT
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", 1024))  # cached token -> user entries
+    AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", 300))  # seconds, never beyond the token's exp
+
+    # Password hashing
+    PASSWORD_HASH_ROUNDS: int = int(os.getenv("PASSWORD_HASH_ROUNDS", 12))  # bcrypt cost factor
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 2))  # threads for bcrypt work
     
     # Server
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", 8000))
 
+    # Logging
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")  # text or json
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped
+    LOG_MAX_FIELD_LENGTH: int = int(os.getenv("LOG_MAX_FIELD_LENGTH", 200))  # characters
+    LOG_REDACT_MESSAGES: bool = os.getenv("LOG_REDACT_MESSAGES", "true").lower() == "true"  # log only their length
+    LOG_SAMPLE_RATES: str = os.getenv("LOG_SAMPLE_RATES", "/health=0,/ready=0,/metrics=0")  # path prefix=rate
+
+    # Inference
+    INFERENCE_WORKERS: int = int(os.getenv("INFERENCE_WORKERS", 1))
+    INFERENCE_QUEUE_SIZE: int = int(os.getenv("INFERENCE_QUEUE_SIZE", 8))
+    INFERENCE_RETRY_AFTER: int = int(os.getenv("INFERENCE_RETRY_AFTER", 5))  # seconds
+    INFERENCE_MAX_BATCH_SIZE: int = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 4))  # concurrent sequences per worker
+    INFERENCE_MAX_WAIT_MS: int = int(os.getenv("INFERENCE_MAX_WAIT_MS", 10))
+    GENERATION_TIMEOUT: float = float(os.getenv("GENERATION_TIMEOUT", 120))  # seconds; per model: "generation_timeout"
+    INFERENCE_PREFILL_CHUNK: int = int(os.getenv("INFERENCE_PREFILL_CHUNK", 64))  # prompt tokens per scheduler step
+
+    # Fair share: each user's generations are charged estimated prompt and
+    # completion tokens against a token bucket, and queued generations are
+    # served in weighted fair order. The quota is off unless tokens per
+    # minute is set; 6000 suits a single 7B model on a CPU host.
+    FAIR_SHARE_TOKENS_PER_MINUTE: float = float(os.getenv("FAIR_SHARE_TOKENS_PER_MINUTE", 0))
+    FAIR_SHARE_BURST_TOKENS: float = float(os.getenv("FAIR_SHARE_BURST_TOKENS", 8192))  # at least one full prompt
+    FAIR_SHARE_WEIGHTS: str = os.getenv("FAIR_SHARE_WEIGHTS", "")  # user id=weight, default 1
+    FAIR_SHARE_MAX_USERS: int = int(os.getenv("FAIR_SHARE_MAX_USERS", 10000))  # buckets kept in memory
+
+    # Model host: when set, API workers forward generations to the model host
+    # process listening on this Unix socket (see run_model_host.py)
+    MODEL_HOST_SOCKET: str = os.getenv("MODEL_HOST_SOCKET", "")
+
+    # Models
+    DEFAULT_MODEL: str = os.getenv("DEFAULT_MODEL", "mistral-7b")
+    MODEL_MEMORY_BUDGET_GB: float = float(os.getenv("MODEL_MEMORY_BUDGET_GB", 8))
+    PROMPT_CACHE_MAX_MB: float = float(os.getenv("PROMPT_CACHE_MAX_MB", 512))  # extra per-chat contexts
+    MODEL_STATUS_DB: str = os.getenv("MODEL_STATUS_DB", "models/status.db")  # shared with other workers; empty to disable
+    MODEL_STATUS_REFRESH: float = float(os.getenv("MODEL_STATUS_REFRESH", 1))  # seconds
+    # Threads and batch size measured by `python -m benchmarks.autotune`; they
+    # override MODELS_CONFIG on the host they were measured on. Empty to disable.
+    MODEL_TUNING_FILE: str = os.getenv("MODEL_TUNING_FILE", "models/tuning.json")
+    MODEL_PREWARM: bool = os.getenv("MODEL_PREWARM", "false").lower() == "true"  # read model files into the page cache before loading
+
+    # Model downloads (fetch_model.py); a model's config may carry "size_bytes"
+    # and "sha256" to verify its file against
+    MODEL_DOWNLOAD_CONNECTIONS: int = int(os.getenv("MODEL_DOWNLOAD_CONNECTIONS", 4))  # parallel range requests
+    MODEL_DOWNLOAD_CHUNK_MB: float = float(os.getenv("MODEL_DOWNLOAD_CHUNK_MB", 64))  # unit of resumption
+    MODEL_DOWNLOAD_TIMEOUT: float = float(os.getenv("MODEL_DOWNLOAD_TIMEOUT", 30))  # seconds without data
+    MODEL_DOWNLOAD_RETRIES: int = int(os.getenv("MODEL_DOWNLOAD_RETRIES", 5))  # per chunk
+    CHAT_HISTORY_WINDOW: int = int(os.getenv("CHAT_HISTORY_WINDOW", 32))  # most recent messages considered for a prompt
+
+    # Conversation summaries: older messages of long chats are folded into a
+    # summary in the background. Keep SUMMARY_TRIGGER_MESSAGES below
+    # CHAT_HISTORY_WINDOW so no message falls between summary and history.
+    SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+    SUMMARY_TRIGGER_MESSAGES: int = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", 24))  # unsummarized messages
+    SUMMARY_KEEP_RECENT: int = int(os.getenv("SUMMARY_KEEP_RECENT", 8))  # newest messages left verbatim
+    SUMMARY_MAX_TOKENS: int = int(os.getenv("SUMMARY_MAX_TOKENS", 256))
+    SUMMARY_IDLE_POLL: float = float(os.getenv("SUMMARY_IDLE_POLL", 1))  # seconds between idle checks
+
+    # Response cache (opt-in)
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", 3600))  # seconds
+
     # LLM Models Configuration
     MODELS_CONFIG: Dict[str, Dict[str, Any]] = {
         "mistral-7b": {
@@ -40,9 +138,14 @@ class Settings:
             "gpu_layers": 0,
             "batch_size": 1,
             "threads": 4,
+            "generation_timeout": 180,  # seconds, CPU only
             "environment": ["development", "production"],
             "file_name": "mistral-7b-instruct-v0.1.Q4_K_M.gguf",
-            "download_url": "https://huggingface.co/TheBloke/Mistral-7B-Instruct-v0.1-GGUF/blob/main/mistral-7b-instruct-v0.1.Q4_K_M.gguf"
+            "download_url": "https://huggingface.co/TheBloke/Mistral-7B-Instruct-v0.1-GGUF/resolve/main/mistral-7b-instruct-v0.1.Q4_K_M.gguf",
+            # Verified by fetch_model.py; when unset, the values Hugging Face
+            # publishes for the file (X-Linked-Size / X-Linked-Etag) are used
+            "size_bytes": None,
+            "sha256": None
         },
         "llama-2-13b": {
             "name": "LLaMA-2 13B",
@@ -52,7 +155,9 @@ class Settings:
             "gpu_layers": 50,  # Using GPU in production
             "environment": ["production"],
             "file_name": "llama-2-13b-chat.Q4_K_M.gguf",
-            "download_url": "https://huggingface.co/TheBloke/Llama-2-13B-chat-GGUF/resolve/main/llama-2-13b-chat.Q4_K_M.gguf"
+            "download_url": "https://huggingface.co/TheBloke/Llama-2-13B-chat-GGUF/resolve/main/llama-2-13b-chat.Q4_K_M.gguf",
+            "size_bytes": None,
+            "sha256": None
         },
         "hermes-13b": {
             "name": "Hermes-3 13B",
@@ -62,7 +167,9 @@ class Settings:
             "gpu_layers": 50,  # Using GPU in production
             "environment": ["production"],
             "file_name": "hermes-13b.Q4_K_M.gguf",
-            "download_url": "https://huggingface.co/TheBloke/Hermes-13B-GGUF/resolve/main/hermes-13b.Q4_K_M.gguf"
+            "download_url": "https://huggingface.co/TheBloke/Hermes-13B-GGUF/resolve/main/hermes-13b.Q4_K_M.gguf",
+            "size_bytes": None,
+            "sha256": None
         },
         "falcon-40b": {
             "name": "Falcon 40B",
@@ -72,7 +179,9 @@ class Settings:
             "gpu_layers": 90,  # More GPU layers for larger model
             "environment": ["production"],
             "file_name": "falcon-40b-instruct.Q4_K_M.gguf",
-            "download_url": "https://huggingface.co/TheBloke/falcon-40b-instruct-GGUF/resolve/main/falcon-40b-instruct.Q4_K_M.gguf"
+            "download_url": "https://huggingface.co/TheBloke/falcon-40b-instruct-GGUF/resolve/main/falcon-40b-instruct.Q4_K_M.gguf",
+            "size_bytes": None,
+            "sha256": None
         }
     }
 
@@ -84,5 +193,15 @@ class Settings:
             if self.ENVIRONMENT in config["environment"]
         }
 
+    def apply_model_tuning(self):
+        """Override models' threads and batch size with the ones tuned for this host"""
+        tuning = read_model_tuning(self.MODEL_TUNING_FILE).get(socket.gethostname(), {})
+        for model_id, tuned in tuning.items():
+            if model_id in self.MODELS_CONFIG:
+                self.MODELS_CONFIG[model_id].update(
+                    {key: tuned[key] for key in TUNED_MODEL_KEYS if key in tuned}
+                )
+
 # Create settings instance
-settings = Settings()
\ No newline at end of file
+settings = Settings()
+settings.apply_model_tuning()
\ No newline at end of file
@@ -1,21 +1,61 @@
-from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
 
-SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
+def get_async_database_url(url: str) -> str:
+    """Map a plain database URL onto its asyncio driver (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False} if settings.DATABASE_URL.startswith("sqlite") else {}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SQLALCHEMY_DATABASE_URL = get_async_database_url(settings.DATABASE_URL)
+
+engine_options = {
+    "pool_size": settings.DATABASE_POOL_SIZE,
+    "max_overflow": settings.DATABASE_MAX_OVERFLOW,
+    "pool_pre_ping": True
+}
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # aiosqlite defaults to opening a new connection per checkout; pool them instead
+    engine_options["poolclass"] = AsyncAdaptedQueuePool
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, **engine_options)
+
+def _sqlite_pragmas() -> list:
+    """Per-connection SQLite settings.
+
+    WAL lets readers run alongside the writer, and with synchronous=NORMAL
+    a commit no longer waits for an fsync (the WAL is synced at checkpoints;
+    a power loss can lose the last commits but not corrupt the database).
+    busy_timeout makes concurrent writers wait for the lock instead of
+    failing, and mmap_size serves reads from the page cache.
+    """
+    pragmas = [
+        f"journal_mode={settings.SQLITE_JOURNAL_MODE}",
+        f"synchronous={settings.SQLITE_SYNCHRONOUS}",
+        f"busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        f"mmap_size={int(settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024)}"
+    ]
+    return [pragma for pragma in pragmas if not pragma.endswith("=")]
+
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in _sqlite_pragmas():
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+# Objects stay usable after commit; lazy loads can't run outside the event loop
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,25 +1,60 @@
+import logging
+
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 
-from app.database import engine, Base
+from app.database import engine
+from app.migrations import init_db
 from app.api import auth, chat, models
-from app.services.auth import get_current_user
+from app.services.auth import get_current_user, password_executor
 from app.services.llm import llm_service  # Import the service
+from app.services.fair_share import fair_share
+from app.services.inference import inference_executor
+from app.services.model_status import model_status_board
+from app.services.prompt_cache import prompt_cache
+from app.services.response_cache import response_cache
+from app.services.summarizer import conversation_summarizer
+from app.services.message_writer import message_writer
+from app.services.metrics import HTTPMetricsMiddleware, metrics
+from app.services.model_host import ModelHostError
+from app.services.logs import LogContextMiddleware, setup_logging, shutdown_logging
 
-app = FastAPI(title="LLM Playground")
+logger = logging.getLogger(__name__)
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+app = FastAPI(title="LLM Playground")
+app.add_middleware(HTTPMetricsMiddleware)
+app.add_middleware(LogContextMiddleware)
 
 # Initialize LLM service
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
-    print("Starting up server...")
-    llm_service.initialize()
-    print("Server startup complete")
+    setup_logging()
+    logger.info("Starting up server...")
+    # Create database tables
+    await init_db(engine)
+    message_writer.start()
+    model_status_board.start()
+    if llm_service.remote is None:
+        inference_executor.start()
+    # Load the default model in the background; see /ready
+    llm_service.start_warmup()
+    conversation_summarizer.start()
+    logger.info("Server startup complete")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers on shutdown"""
+    await conversation_summarizer.stop()
+    # Save queued messages before the engine goes away
+    await message_writer.stop()
+    inference_executor.stop()
+    model_status_board.stop()
+    password_executor.shutdown(wait=False)
+    await engine.dispose()
+    shutdown_logging()
 
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -40,6 +75,32 @@ async def root(request: Request):
 async def chat_page(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request})
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the default model has been warmed up"""
+    readiness = await llm_service.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics of this process, plus the model host's if there is one"""
+    text = metrics.render()
+    if llm_service.remote is not None:
+        try:
+            text += await llm_service.remote.metrics()
+        except ModelHostError as e:
+            logger.warning("Could not fetch model host metrics: %s", e)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    """Liveness probe, answered even while models are loading"""
+    return {
+        "status": "healthy",
+        "inference": inference_executor.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "summarizer": conversation_summarizer.stats(),
+        "message_writer": message_writer.stats(),
+        "fair_share": fair_share.stats()
+    }
\ No newline at end of file
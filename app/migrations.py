@@ -0,0 +1,43 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database import Base
+from app.services.search import create_search_index
+
+logger = logging.getLogger(__name__)
+
+async def init_db(engine: AsyncEngine):
+    """Create missing tables and apply migrations"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+        await conn.run_sync(create_search_index)
+
+def run_migrations(conn: Connection):
+    """Bring an existing database up to date with the models.
+
+    create_all() only creates missing tables, so columns and indexes added
+    to existing models are added here. New columns must therefore be nullable.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            logger.info("Adding column %s.%s", table.name, column.name)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            logger.info("Creating index %s", index.name)
+            index.create(conn)
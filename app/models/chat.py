@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -12,11 +12,18 @@ class Chat(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    summary = Column(Text, nullable=True)  # Summary of older messages, used in place of them in prompts
+    summary_message_id = Column(Integer, nullable=True)  # Last message the summary covers
 
     # Relationships
     user = relationship("User", back_populates="chats")
     messages = relationship("ChatMessage", back_populates="chat", order_by="ChatMessage.created_at")
 
+    # Serves a user's chat list, newest first, with keyset pagination
+    __table_args__ = (
+        Index("ix_chats_user_id_updated_at", "user_id", "updated_at", "id"),
+    )
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
@@ -24,7 +31,14 @@ class ChatMessage(Base):
     chat_id = Column(Integer, ForeignKey("chats.id"))
     user_message = Column(Text)
     assistant_response = Column(Text)
+    token_count = Column(Integer, nullable=True)  # Tokens of the formatted turn, for the chat's model
+    finish_reason = Column(String, nullable=True)  # stop, length, or deadline when the response was cut short
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationship
-    chat = relationship("Chat", back_populates="messages")
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages")
+
+    # Serves a chat's messages in order, with keyset pagination
+    __table_args__ = (
+        Index("ix_chat_messages_chat_id_created_at", "chat_id", "created_at", "id"),
+    )
\ No newline at end of file
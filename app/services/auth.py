@@ -1,10 +1,17 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
 from app.models.user import User
@@ -15,16 +22,101 @@ SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing. Stored hashes with a different cost are upgraded on login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.PASSWORD_HASH_ROUNDS
+)
+# bcrypt is deliberately slow, so it runs here instead of on the event loop.
+# The pool size caps how much CPU a burst of logins can take.
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+class TokenUserCache:
+    """Bounded cache of verified access tokens and the users they resolve to.
+
+    Entries expire at the token's `exp` claim or after ttl_seconds, whichever
+    comes first. Cached users are detached instances, so only read them.
+
+    The cache is per process: code changing a User row calls invalidate_user,
+    but other workers, and changes made outside the app, keep serving the old
+    row for at most ttl_seconds.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[User]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def put(self, token: str, user: User, token_expires_at: float):
+        expires_at = min(token_expires_at, time.time() + self.ttl_seconds)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        """Drop every cached token of a user; call it wherever a User row changes"""
+        with self._lock:
+            for key in [key for key, (_, user) in self._entries.items() if user.username == username]:
+                del self._entries[key]
+
+token_user_cache = TokenUserCache(
+    max_entries=settings.AUTH_CACHE_SIZE,
+    ttl_seconds=settings.AUTH_CACHE_TTL
+)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def _verify_and_rehash(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(plain_password)
+    return True, None
+
+async def hash_password_async(password: str) -> str:
+    """get_password_hash on the password hashing pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password on the password hashing pool.
+
+    Returns (valid, new_hash). new_hash is set when the password is valid but
+    its stored hash doesn't match the configured scheme or cost any more.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, _verify_and_rehash, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -35,7 +127,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
+    # Tokens verified recently resolve without decoding or a database round trip
+    user = token_user_cache.get(token)
+    if user is not None:
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -49,7 +146,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
     if user is None:
         raise credentials_exception
+
+    db.expunge(user)
+    # Tokens without an expiry are still accepted, just never cached
+    expires_at = payload.get("exp")
+    if expires_at is not None:
+        token_user_cache.put(token, user, expires_at)
     return user
\ No newline at end of file
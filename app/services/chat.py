@@ -1,15 +1,45 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Row, and_, desc, func, or_, select, update
 from app.models.chat import Chat, ChatMessage
+from app.services.metrics import timed_db
+from app.services.search import index_messages
 
-async def create_new_chat(db: Session, user_id: int, model_name: str) -> Chat:
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Opaque pagination cursor pointing just past the given row"""
+    raw = json.dumps([timestamp.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def _before(timestamp_column, id_column, cursor: str):
+    """Rows strictly before the cursor in (timestamp, id) descending order"""
+    timestamp, row_id = decode_cursor(cursor)
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < row_id)
+    )
+
+@timed_db
+async def create_new_chat(db: AsyncSession, user_id: int, model_name: str) -> Chat:
     """Create a new chat with auto-numbered title"""
     # Get the last chat number for this model
-    last_chat = db.query(Chat).filter(
-        Chat.user_id == user_id,
-        Chat.model_name == model_name
-    ).order_by(desc(Chat.created_at)).first()
+    result = await db.execute(
+        select(Chat).where(
+            Chat.user_id == user_id,
+            Chat.model_name == model_name
+        ).order_by(desc(Chat.created_at)).limit(1)
+    )
+    last_chat = result.scalar_one_or_none()
 
     # Generate new chat number
     if last_chat:
@@ -26,48 +56,159 @@ async def create_new_chat(db: Session, user_id: int, model_name: str) -> Chat:
         user_id=user_id
     )
     db.add(chat)
-    db.commit()
-    db.refresh(chat)
+    # The insert fills in the id, and defaults are set client-side, so
+    # there's nothing to refresh
+    await db.commit()
     return chat
 
-async def add_message_to_chat(
-    db: Session,
+@timed_db
+async def save_chat_messages(
+    db: AsyncSession,
+    messages: List[Tuple[int, str, str, Optional[str]]],
+    token_counts: Dict[int, int]
+):
+    """Insert (chat_id, user_message, assistant_response, finish_reason) message
+    pairs, add them to the search index and store token counts computed for
+    earlier messages, in a single commit"""
+    rows = [
+        ChatMessage(
+            chat_id=chat_id,
+            user_message=user_message,
+            assistant_response=assistant_response,
+            finish_reason=finish_reason
+        )
+        for chat_id, user_message, assistant_response, finish_reason in messages
+    ]
+    db.add_all(rows)
+    # The index needs the new ids
+    await db.flush()
+    await index_messages(db, rows)
+    if token_counts:
+        await db.execute(update(ChatMessage), [
+            {"id": message_id, "token_count": token_count}
+            for message_id, token_count in token_counts.items()
+        ])
+    await db.commit()
+
+def _history_query(chat_id: int, after_id: Optional[int]):
+    """Columns a prompt needs of the chat's messages after after_id"""
+    query = select(
+        ChatMessage.id,
+        ChatMessage.user_message,
+        ChatMessage.assistant_response,
+        ChatMessage.token_count
+    ).where(ChatMessage.chat_id == chat_id)
+    if after_id is not None:
+        query = query.where(ChatMessage.id > after_id)
+    return query
+
+@timed_db
+async def get_chat_history(
+    db: AsyncSession,
     chat_id: int,
-    user_message: str,
-    assistant_response: str
-) -> ChatMessage:
-    """Add a new message pair to the chat"""
-    message = ChatMessage(
-        chat_id=chat_id,
-        user_message=user_message,
-        assistant_response=assistant_response
+    limit: int,
+    after_id: Optional[int] = None
+) -> List[Row]:
+    """Get the chat's most recent messages for building a prompt, oldest first.
+
+    Only the columns the prompt needs are loaded, as plain rows rather than
+    ORM objects, and only the last `limit` messages are read. Messages up to
+    after_id, which the chat's summary covers, are skipped.
+    """
+    result = await db.execute(
+        _history_query(chat_id, after_id)
+        .order_by(desc(ChatMessage.created_at), desc(ChatMessage.id)).limit(limit)
     )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
-    return message
+    history = list(result.all())
+    history.reverse()
+    return history
 
-async def get_chat_history(
-    db: Session,
+@timed_db
+async def get_unsummarized_messages(
+    db: AsyncSession,
     chat_id: int,
-    limit: int = None
-) -> List[ChatMessage]:
-    """Get chat history, optionally limited to recent messages"""
-    query = db.query(ChatMessage).filter(
-        ChatMessage.chat_id == chat_id
-    ).order_by(ChatMessage.created_at)
-    
-    if limit:
-        query = query.limit(limit)
-    
-    return query.all()
-
-async def get_user_chats(db: Session, user_id: int) -> List[Chat]:
-    """Get all chats for a user"""
-    return db.query(Chat).filter(
-        Chat.user_id == user_id
-    ).order_by(desc(Chat.updated_at)).all()
-
-async def get_chat(db: Session, chat_id: int) -> Optional[Chat]:
+    after_id: Optional[int],
+    limit: int
+) -> Tuple[List[Row], int]:
+    """The oldest `limit` messages after after_id, oldest first, and how many there are in total"""
+    total = await db.scalar(select(func.count()).select_from(_history_query(chat_id, after_id).subquery()))
+    result = await db.execute(
+        _history_query(chat_id, after_id)
+        .order_by(ChatMessage.created_at, ChatMessage.id).limit(limit)
+    )
+    return list(result.all()), total
+
+@timed_db
+async def update_chat_summary(
+    db: AsyncSession,
+    chat_id: int,
+    summary: str,
+    summary_message_id: int,
+    previous_message_id: Optional[int]
+) -> bool:
+    """Store a new summary unless another worker has replaced the previous one meanwhile"""
+    previous = (
+        Chat.summary_message_id.is_(None) if previous_message_id is None
+        else Chat.summary_message_id == previous_message_id
+    )
+    result = await db.execute(
+        update(Chat)
+        .where(Chat.id == chat_id, previous)
+        # Compaction isn't chat activity, so keep the chat's place in the list
+        .values(summary=summary, summary_message_id=summary_message_id, updated_at=Chat.updated_at)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+@timed_db
+async def get_chat_messages_page(
+    db: AsyncSession,
+    chat_id: int,
+    limit: int,
+    cursor: Optional[str] = None
+) -> Tuple[List[ChatMessage], Optional[str]]:
+    """Get a page of a chat's messages, newest page first.
+
+    Messages within a page are in chronological order. The returned cursor
+    fetches the page of older messages and is None on the oldest page.
+    """
+    query = select(ChatMessage).where(ChatMessage.chat_id == chat_id)
+    if cursor:
+        query = query.where(_before(ChatMessage.created_at, ChatMessage.id, cursor))
+    query = query.order_by(desc(ChatMessage.created_at), desc(ChatMessage.id)).limit(limit + 1)
+
+    messages = list((await db.execute(query)).scalars().all())
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1].created_at, messages[-1].id)
+    messages.reverse()
+    return messages, next_cursor
+
+@timed_db
+async def get_user_chats(
+    db: AsyncSession,
+    user_id: int,
+    limit: int,
+    cursor: Optional[str] = None
+) -> Tuple[List[Chat], Optional[str]]:
+    """Get a page of a user's chats, most recently updated first.
+
+    The returned cursor fetches the next page and is None on the last page.
+    """
+    query = select(Chat).where(Chat.user_id == user_id)
+    if cursor:
+        query = query.where(_before(Chat.updated_at, Chat.id, cursor))
+    query = query.order_by(desc(Chat.updated_at), desc(Chat.id)).limit(limit + 1)
+
+    chats = list((await db.execute(query)).scalars().all())
+    next_cursor = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1].updated_at, chats[-1].id)
+    return chats, next_cursor
+
+@timed_db
+async def get_chat(db: AsyncSession, chat_id: int) -> Optional[Chat]:
     """Get a specific chat by ID"""
-    return db.query(Chat).filter(Chat.id == chat_id).first()
\ No newline at end of file
+    return await db.get(Chat, chat_id)
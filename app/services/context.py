@@ -0,0 +1,69 @@
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class PromptTooLong(ValueError):
+    """Raised when a message doesn't fit the model's context window on its own"""
+
+def format_turn(user_message: str, assistant_response: str) -> str:
+    """Format one completed exchange"""
+    return f"[INST] {user_message} [/INST] {assistant_response}</s>"
+
+def format_summary(summary: str) -> str:
+    """Format the summary of a chat's older messages as an opening exchange"""
+    return format_turn(f"Summary of our conversation so far: {summary}", "Understood.")
+
+def format_prompt(turns: List[str], message: str, summary: Optional[str] = None) -> str:
+    """Join the summary, formatted turns (oldest first) and the new message into a prompt"""
+    opening = format_summary(summary) if summary else ""
+    return "<s>" + opening + "".join(turns) + f"[INST] {message} [/INST]"
+
+def build_prompt(
+    message: str,
+    chat_history: List[Dict],
+    count_tokens: Callable[[str], int],
+    max_tokens: int,
+    summary: Optional[str] = None
+) -> str:
+    """Build a prompt holding as much recent history as fits in max_tokens.
+
+    History is walked newest first and stops at the first turn that no longer
+    fits, so older turns are the ones dropped. Each history item's
+    `token_count` is used when present and filled in when missing, so callers
+    can persist it and a message is only tokenized once. count_tokens must not
+    count the BOS token; one token is reserved for it here.
+
+    A summary of the messages before chat_history comes first and is left
+    out only when it doesn't fit next to the message at all.
+    """
+    budget = max_tokens - 1 - count_tokens(format_prompt([], message))
+    if budget < 0:
+        raise PromptTooLong("Message is too long for the model's context window")
+    if summary:
+        summary_tokens = count_tokens(format_summary(summary))
+        if summary_tokens <= budget:
+            budget -= summary_tokens
+        else:
+            summary = None
+
+    turns = []
+    for msg in reversed(chat_history or []):
+        turn = format_turn(msg["user_message"], msg["assistant_response"])
+        if msg.get("token_count") is None:
+            msg["token_count"] = count_tokens(turn)
+        if msg["token_count"] > budget:
+            break
+        budget -= msg["token_count"]
+        turns.append(turn)
+    turns.reverse()
+
+    # Per-turn counts can differ slightly from tokenizing the joined prompt,
+    # so check the real length and drop the oldest turns if it overflows
+    prompt = format_prompt(turns, message, summary)
+    while turns and count_tokens(prompt) + 1 > max_tokens:
+        turns.pop(0)
+        prompt = format_prompt(turns, message, summary)
+
+    logger.debug("Included %d of %d previous messages", len(turns), len(chat_history or []))
+    return prompt
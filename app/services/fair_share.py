@@ -0,0 +1,125 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.config import settings
+from app.services.metrics import QUOTA_REJECTIONS
+
+class QuotaExceeded(Exception):
+    """Raised when a user has used up their share of the model for now"""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Token quota exceeded, retry in {retry_after}s")
+
+def parse_weights(spec: str) -> Dict[int, float]:
+    """Parse "1=4,7=2" into {user id: weight}"""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        user_id, _, weight = item.partition("=")
+        weights[int(user_id)] = max(0.01, float(weight))
+    return weights
+
+class _Bucket:
+    __slots__ = ("level", "updated")
+
+    def __init__(self, level: float, updated: float):
+        self.level = level
+        self.updated = updated
+
+class FairShare:
+    """Per-user token buckets for the shared models.
+
+    A generation is charged its estimated prompt and completion tokens when
+    it is queued, and the estimate is settled against the tokens actually
+    evaluated and generated once it finishes. Buckets refill at
+    tokens_per_minute times the user's weight, up to burst_tokens times the
+    weight; a request is refused while its user's bucket can't cover it, so
+    a few users firing long prompts can't starve everyone else. The weights
+    also set each user's share of the inference queue (see inference.Share).
+
+    Buckets live in this process. With a model host, generations are
+    admitted there, so all API workers share them.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: float,
+        burst_tokens: float,
+        weights: Optional[Dict[int, float]] = None,
+        max_users: int = 10000
+    ):
+        self.enabled = tokens_per_minute > 0
+        self.rate = tokens_per_minute / 60
+        self.burst_tokens = burst_tokens
+        self.weights = weights or {}
+        self.max_users = max_users
+        self._buckets: "OrderedDict[int, _Bucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def weight(self, user_id: Optional[int]) -> float:
+        return self.weights.get(user_id, 1.0)
+
+    def _bucket(self, user_id: int, now: float) -> _Bucket:
+        """The user's bucket, refilled up to now (call with the lock held)"""
+        capacity = self.burst_tokens * self.weight(user_id)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(capacity, now)
+            # A user dropped here comes back with a full bucket, which is
+            # also where an idle user's bucket would be
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.level = min(capacity, bucket.level + (now - bucket.updated) * self.rate * self.weight(user_id))
+            bucket.updated = now
+        return bucket
+
+    def charge(self, user_id: Optional[int], tokens: int):
+        """Take tokens from the user's bucket or raise QuotaExceeded.
+
+        Requests larger than the bucket only need a full one, and may take
+        it below zero; the debt is paid off before the next is admitted.
+        Generations not made for a user (user_id None) are never charged.
+        """
+        if not self.enabled or user_id is None:
+            return
+        with self._lock:
+            bucket = self._bucket(user_id, time.monotonic())
+            needed = min(tokens, self.burst_tokens * self.weight(user_id))
+            if bucket.level < needed:
+                self.rejected += 1
+                QUOTA_REJECTIONS.inc()
+                refill_rate = self.rate * self.weight(user_id)
+                raise QuotaExceeded(max(1, math.ceil((needed - bucket.level) / refill_rate)))
+            bucket.level -= tokens
+
+    def settle(self, user_id: Optional[int], charged: int, used: int):
+        """Correct an earlier charge to the tokens actually used"""
+        if not self.enabled or user_id is None or charged == used:
+            return
+        with self._lock:
+            bucket = self._bucket(user_id, time.monotonic())
+            bucket.level = min(self.burst_tokens * self.weight(user_id), bucket.level + charged - used)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "users": len(self._buckets),
+                "rejected": self.rejected
+            }
+
+# Global instance
+fair_share = FairShare(
+    tokens_per_minute=settings.FAIR_SHARE_TOKENS_PER_MINUTE,
+    burst_tokens=settings.FAIR_SHARE_BURST_TOKENS,
+    weights=parse_weights(settings.FAIR_SHARE_WEIGHTS),
+    max_users=settings.FAIR_SHARE_MAX_USERS
+)
@@ -0,0 +1,128 @@
+import re
+import time
+from typing import Iterator, List, Optional
+
+class FinishReason:
+    STOP = "stop"  # end of sequence or a stop sequence
+    LENGTH = "length"  # max_new_tokens reached
+    DEADLINE = "deadline"  # the request ran out of time; the response is partial
+    CANCELLED = "cancelled"  # the caller stopped reading, e.g. the client disconnected
+    ERROR = "error"
+
+    # Completions that end before the model was done
+    PARTIAL = {DEADLINE, CANCELLED}
+
+class GenerationStats:
+    """Token counts, compute time and finish reason of one generation.
+
+    Times only cover model work, not the time the generator spends suspended
+    while the scheduler runs other sequences. finish_reason stays None while
+    the generation runs and if it's closed before finishing.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        # Prompt tokens already in the model's context, so not evaluated
+        self.cached_prompt_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        self.completion_tokens = 0
+        self.decode_seconds = 0.0
+        self.finish_reason: Optional[str] = None
+
+    @property
+    def partial(self) -> bool:
+        return self.finish_reason in FinishReason.PARTIAL
+
+def deadline_passed(deadline: Optional[float]) -> bool:
+    """Whether a time.monotonic() deadline has passed (None never does)"""
+    return deadline is not None and time.monotonic() >= deadline
+
+def generate_tokens(
+    model,
+    prompt: str,
+    max_new_tokens: int,
+    stop: List[str],
+    prefill_chunk: int,
+    stats: Optional[GenerationStats] = None,
+    deadline: Optional[float] = None,
+    **sampling
+) -> Iterator[Optional[str]]:
+    """Token-level generation loop for one sequence.
+
+    Mirrors ctransformers' own streaming (prefix reuse, UTF-8 handling, stop
+    sequences), but evaluates the prompt in chunks of prefill_chunk tokens and
+    yields None between them, so a scheduler can interleave a long prompt
+    with other sequences' decode steps. Text chunks are yielded per token.
+    Token counts, timings and the finish reason are recorded in stats when
+    given.
+
+    The deadline (a time.monotonic() value) is checked before every prompt
+    chunk and every token, so a generation past it stops within one step,
+    keeping the text produced so far.
+    """
+    # Imported here so the API can start without loading ctransformers
+    from ctransformers.utils import utf8_split_incomplete
+
+    prompt_tokens = model.tokenize(prompt)
+    # Drops the prefix already in the model's context
+    tokens = model.prepare_inputs_for_generation(prompt_tokens, reset=True)
+    stats = stats or GenerationStats()
+    stats.prompt_tokens = len(tokens)
+    stats.cached_prompt_tokens = len(prompt_tokens) - len(tokens)
+    for start in range(0, len(tokens), prefill_chunk):
+        if deadline_passed(deadline):
+            stats.finish_reason = FinishReason.DEADLINE
+            return
+        started = time.perf_counter()
+        model.eval(tokens[start:start + prefill_chunk])
+        stats.prompt_eval_seconds += time.perf_counter() - started
+        if start + prefill_chunk < len(tokens):
+            yield None
+
+    stop_regex = re.compile("|".join(map(re.escape, stop))) if stop else None
+    text = ""
+    incomplete = b""
+    for _ in range(max_new_tokens):
+        if deadline_passed(deadline):
+            stats.finish_reason = FinishReason.DEADLINE
+            break
+        started = time.perf_counter()
+        token = model.sample(**sampling)
+        model.eval([token])
+        stats.decode_seconds += time.perf_counter() - started
+        if model.is_eos_token(token):
+            stats.finish_reason = FinishReason.STOP
+            break
+        stats.completion_tokens += 1
+
+        # Handle incomplete UTF-8 multi-byte characters
+        incomplete += model.detokenize([token], decode=False)
+        complete, incomplete = utf8_split_incomplete(incomplete)
+        text += complete.decode(errors="ignore")
+
+        if stop_regex:
+            match = stop_regex.search(text)
+            if match:
+                text = text[:match.start()]
+                stats.finish_reason = FinishReason.STOP
+                break
+
+        # Hold back a suffix that could be the start of a stop sequence
+        longest = 0
+        for s in stop:
+            for i in range(len(s), 0, -1):
+                if text.endswith(s[:i]):
+                    longest = max(i, longest)
+                    break
+
+        end = len(text) - longest
+        if end > 0:
+            yield text[:end]
+            text = text[end:]
+        else:
+            yield None
+    else:
+        stats.finish_reason = FinishReason.LENGTH
+
+    if text:
+        yield text
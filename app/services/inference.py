@@ -0,0 +1,428 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from app.config import settings
+from app.services.metrics import INFERENCE_ACTIVE, INFERENCE_QUEUE_DEPTH, metrics
+
+logger = logging.getLogger(__name__)
+
+_STREAM_END = object()
+
+# Yielded by a stream job that is blocked on a busy resource
+WAITING = object()
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot accept another request"""
+
+    def __init__(self, queue_depth: int, retry_after: int):
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        super().__init__(f"Inference queue is full ({queue_depth} requests waiting)")
+
+class ResourceBusy(Exception):
+    """Raised instead of blocking when a resource is held by another sequence.
+
+    A generation step that raises this is retried on the next scheduler
+    round, since the holder may be running on the same worker thread.
+    """
+
+class ClosingStream:
+    """Async iterator over an async generator whose aclose() also works
+    before the first item.
+
+    Closing an async generator that never started doesn't run its finally
+    blocks, so a stream abandoned before its first chunk would leave its
+    generation running. on_early_close is awaited in that case instead.
+    """
+
+    def __init__(self, iterator: AsyncIterator[Any], on_early_close: Callable[[], Awaitable[None]]):
+        self._iterator = iterator
+        self._on_early_close = on_early_close
+        self._started = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self._started = True
+        return await self._iterator.__anext__()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        await self._iterator.aclose()
+        if not self._started:
+            await self._on_early_close()
+
+class Share(NamedTuple):
+    """Whom a job runs for, what it costs and how much of the queue they get"""
+    tenant: Any = None
+    cost: float = 1.0
+    weight: float = 1.0
+
+class _FairQueue:
+    """Bounded job queue served in start-time fair queueing order.
+
+    Each job gets a virtual start tag: the later of the current virtual time
+    and the finish tag of its tenant's previous job, where a job's finish tag
+    is its start tag plus cost / weight. Jobs are taken lowest start tag
+    first. A tenant who keeps queueing expensive jobs therefore falls behind
+    everyone else, while one who has been idle is served next, however
+    long the queue. Jobs of a single tenant keep FIFO order.
+
+    The None shutdown marker sorts after every job, and isn't bounded by
+    maxsize, so queued jobs still run before a worker stops.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._heap: List[tuple] = []
+        self._sequence = itertools.count()
+        self._finish: Dict[Any, float] = {}
+        self._virtual_time = 0.0
+        self._jobs = 0
+        self._not_empty = threading.Condition()
+
+    def put_nowait(self, job, share: Share = Share()):
+        with self._not_empty:
+            if job is None:
+                start = math.inf
+            else:
+                if self._jobs >= self.maxsize:
+                    raise queue.Full
+                start = max(self._virtual_time, self._finish.get(share.tenant, 0.0))
+                self._finish[share.tenant] = start + share.cost / share.weight
+                self._jobs += 1
+            heapq.heappush(self._heap, (start, next(self._sequence), job))
+            self._not_empty.notify()
+
+    def put(self, job, share: Share = Share()):
+        self.put_nowait(job, share)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        with self._not_empty:
+            if not block:
+                if not self._heap:
+                    raise queue.Empty
+            elif not self._not_empty.wait_for(lambda: self._heap, timeout):
+                raise queue.Empty
+            start, _, job = heapq.heappop(self._heap)
+            if job is not None:
+                self._jobs -= 1
+                self._virtual_time = start
+                if len(self._finish) > 2 * self._jobs + 64:
+                    # Tenants whose tags have fallen behind are no different
+                    # from ones never seen
+                    self._finish = {
+                        tenant: finish for tenant, finish in self._finish.items() if finish > start
+                    }
+            return job
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        with self._not_empty:
+            return self._jobs
+
+class _CallJob:
+    """A blocking call that runs to completion when admitted"""
+
+    def __init__(self, future: Future, fn: Callable, args: tuple, kwargs: dict):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def start(self) -> bool:
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+        return False
+
+class _StreamJob:
+    """A generator advanced one item per scheduler round.
+
+    The generator may yield None to give up its turn without producing
+    output, e.g. between prompt-evaluation chunks, or WAITING when it
+    cannot make progress until another sequence releases something.
+    """
+
+    def __init__(self, future: Future, fn: Callable, args: tuple, kwargs: dict, publish: Callable, stopped: threading.Event):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.publish = publish
+        self.stopped = stopped
+        self.iterator = None
+
+    def start(self) -> bool:
+        try:
+            self.iterator = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.publish(_STREAM_END, e)
+            self.future.set_result(None)
+            return False
+        return True
+
+    def step(self) -> Optional[bool]:
+        """Advance once. Returns True if the job made progress, False if it
+        is waiting, None when it has finished."""
+        if self.stopped.is_set():
+            self._finish()
+            return None
+        try:
+            item = next(self.iterator)
+        except StopIteration:
+            self._finish()
+            return None
+        except BaseException as e:
+            self._finish(e)
+            return None
+        if item is WAITING:
+            return False
+        if item is not None:
+            self.publish(item)
+        return True
+
+    def _finish(self, error: Optional[BaseException] = None):
+        # Release whatever the generator holds (e.g. the model) right away
+        self.iterator.close()
+        self.publish(_STREAM_END, error)
+        self.future.set_result(None)
+
+class InferenceExecutor:
+    """Runs model work on dedicated worker threads behind a bounded queue.
+
+    The event loop only ever enqueues work and awaits the result, so a long
+    generation no longer stalls unrelated endpoints. Each worker schedules up
+    to max_batch_size streaming generations at once and advances them
+    round-robin, one step each, so short answers aren't stuck behind long
+    ones. An idle worker waits max_wait seconds after the first arrival to
+    collect requests that arrive together. Queued jobs are admitted in
+    weighted fair order of their Share rather than first come, first served.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue_size: int,
+        retry_after: int,
+        max_batch_size: int = 1,
+        max_wait: float = 0.0
+    ):
+        self.workers = max(1, workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.retry_after = retry_after
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._queue = _FairQueue(self.max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"inference-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(
+            "Started %d worker(s), queue size %d, batch size %d",
+            self.workers, self.max_queue_size, self.max_batch_size
+        )
+
+    def stop(self):
+        """Let queued jobs finish, then stop the worker threads"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _next_job(self, active: List[_StreamJob], deadline: Optional[float]):
+        """Take the next queued job without holding up a running batch"""
+        if not active and deadline is None:
+            return self._queue.get()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                return self._queue.get(timeout=remaining)
+        return self._queue.get_nowait()
+
+    def _admit(self, active: List[_StreamJob]) -> bool:
+        """Move queued jobs into the active batch. Returns False on shutdown."""
+        deadline = None
+        while len(active) < self.max_batch_size:
+            try:
+                job = self._next_job(active, deadline)
+            except queue.Empty:
+                break
+            if job is None:
+                return False
+            if deadline is None and not active:
+                # First arrival on an idle worker: wait briefly for company
+                deadline = time.monotonic() + self.max_wait
+
+            # The awaiting request may have been cancelled while queued
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            with self._lock:
+                self._active += 1
+            if job.start():
+                active.append(job)
+            else:
+                self._job_done()
+        return True
+
+    def _job_done(self):
+        with self._lock:
+            self._active -= 1
+            self._completed += 1
+
+    def _worker(self):
+        active: List[_StreamJob] = []
+        running = True
+        while running or active:
+            if running:
+                running = self._admit(active)
+
+            progressed = False
+            for job in list(active):
+                result = job.step()
+                if result is None:
+                    active.remove(job)
+                    self._job_done()
+                elif result:
+                    progressed = True
+
+            if active and not progressed:
+                # Everyone is waiting on a busy resource; don't spin
+                time.sleep(0.005)
+
+    def _enqueue(self, job, share: Optional[Share]):
+        self.start()
+        try:
+            self._queue.put_nowait(job, share or Share())
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError(self.queue_depth, self.retry_after)
+
+    def submit(self, fn: Callable, *args, share: Optional[Share] = None, **kwargs) -> asyncio.Future:
+        """Queue a blocking call and return an awaitable for its result.
+
+        Raises QueueFullError immediately instead of waiting for a free slot.
+        The call holds up its worker's whole batch until it returns, so use
+        stream() for generations.
+        """
+        future: Future = Future()
+        self._enqueue(_CallJob(future, fn, args, kwargs), share)
+        return asyncio.wrap_future(future)
+
+    def stream(self, fn: Callable, *args, share: Optional[Share] = None, **kwargs) -> ClosingStream:
+        """Queue a blocking generator function and iterate its items asynchronously.
+
+        The job is queued immediately, so QueueFullError is raised here rather
+        than on first iteration. Closing the iterator early stops the worker at
+        the next item. share places the job in the fair queue; jobs without
+        one are all charged to the same anonymous tenant.
+        """
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def publish(item, error=None):
+            try:
+                loop.call_soon_threadsafe(items.put_nowait, (item, error))
+            except RuntimeError:
+                # Event loop already closed - nobody is listening any more
+                stopped.set()
+
+        future: Future = Future()
+        self._enqueue(_StreamJob(future, fn, args, kwargs, publish, stopped), share)
+        # Cancelling this drops the job if it hasn't been admitted yet
+        awaitable = asyncio.wrap_future(future)
+
+        async def stop():
+            stopped.set()
+            awaitable.cancel()
+
+        async def iterate():
+            try:
+                while True:
+                    item, error = await items.get()
+                    if item is _STREAM_END:
+                        if error is not None:
+                            raise error
+                        return
+                    yield item
+            finally:
+                await stop()
+
+        return ClosingStream(iterate(), stop)
+
+    @property
+    def running(self) -> bool:
+        with self._lock:
+            return bool(self._threads)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "max_queue_size": self.max_queue_size,
+                "max_batch_size": self.max_batch_size,
+                "active": self._active,
+                "completed": self._completed,
+                "rejected": self._rejected
+            }
+
+# Global instance
+inference_executor = InferenceExecutor(
+    workers=settings.INFERENCE_WORKERS,
+    max_queue_size=settings.INFERENCE_QUEUE_SIZE,
+    retry_after=settings.INFERENCE_RETRY_AFTER,
+    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+    max_wait=settings.INFERENCE_MAX_WAIT_MS / 1000
+)
+
+def _collect_metrics():
+    if not inference_executor.running:
+        return
+    stats = inference_executor.stats()
+    INFERENCE_QUEUE_DEPTH.set(stats["queue_depth"])
+    INFERENCE_ACTIVE.set(stats["active"])
+
+metrics.add_collector(_collect_metrics)
@@ -1,167 +1,532 @@
+import asyncio
+import logging
 import os
 import time
-import json
-import traceback
-from typing import Optional, Dict
-from ctransformers import AutoModelForCausalLM
+from contextlib import ExitStack, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
 from app.config import settings
+from app.services.fair_share import QuotaExceeded, fair_share
+from app.services.inference import inference_executor, ClosingStream, QueueFullError, ResourceBusy, Share, WAITING
+from app.services.model_download import prewarm
+from app.services.model_registry import ModelRegistry
+from app.services.model_status import model_status_board
+from app.services.prompt_cache import prompt_cache
+from app.services.context import PromptTooLong, build_prompt, format_prompt, format_turn
+from app.services.response_cache import response_cache
+from app.services.generation import FinishReason, GenerationStats, deadline_passed, generate_tokens
+from app.services.metrics import (
+    COMPLETION_TOKENS,
+    GENERATIONS,
+    GENERATION_SECONDS,
+    PROMPT_EVAL_SECONDS,
+    PROMPT_TOKENS,
+    TIME_TO_FIRST_TOKEN,
+    TOKENS_PER_SECOND
+)
+from app.services.model_host import ModelHostClient, ModelHostError
 
-class ModelStatus:
-    LOADING = "loading"
-    READY = "ready"
-    ERROR = "error"
-
-def write_status(model_name: str, status: str, error: str = None):
-    """Write model status to a file"""
-    status_file = f"models/{model_name}_status.json"
-    with open(status_file, 'w') as f:
-        json.dump({
-            "status": status,
-            "error": error,
-            "timestamp": time.time()
-        }, f)
-
-def read_status(model_name: str) -> Dict:
-    """Read model status from file"""
-    status_file = f"models/{model_name}_status.json"
+logger = logging.getLogger(__name__)
+
+# Sampling params used when a request doesn't specify its own
+DEFAULT_SAMPLING = {"temperature": 0.7}
+
+class GenerationTimeout(Exception):
+    """Raised when a request's deadline passes before the model produced any text"""
+
+def generation_timeout(model_name: str) -> float:
+    """Seconds a request may take, from queueing to its last token"""
+    return settings.MODELS_CONFIG[model_name].get("generation_timeout", settings.GENERATION_TIMEOUT)
+
+def estimate_tokens(
+    model_name: str,
+    message: str,
+    chat_history: list = None,
+    summary: Optional[str] = None,
+    sampling: Optional[Dict] = None
+) -> int:
+    """Upper estimate of the prompt and completion tokens of a generation,
+    made before the prompt is built with the model's tokenizer"""
+    model_config = settings.MODELS_CONFIG[model_name]
+    max_new_tokens = (sampling or {}).get("max_new_tokens", model_config.get("max_new_tokens", 512))
+    # About three characters per token, or the counts stored with the history
+    texts = [message, summary or ""]
+    prompt_tokens = sum(len(text) // 3 + 1 for text in texts)
+    for msg in chat_history or []:
+        if msg.get("token_count") is not None:
+            prompt_tokens += msg["token_count"]
+        else:
+            prompt_tokens += (len(msg["user_message"]) + len(msg["assistant_response"])) // 3 + 1
+    # build_prompt drops whatever doesn't fit the context window
+    prompt_tokens = min(prompt_tokens, model_config.get("context_length", 2048) - max_new_tokens)
+    return prompt_tokens + max_new_tokens
+
+def create_model(model_config: Dict):
+    """Create a model instance from its config.
+
+    threads and batch_size (prompt tokens per evaluation step) come from the
+    model's config, as tuned for this host if it has been; without them
+    ctransformers picks its own defaults.
+    """
+    # Imported on first load, which keeps it out of API startup
+    from ctransformers import AutoModelForCausalLM
+
+    options = {key: model_config[key] for key in ("threads", "batch_size") if key in model_config}
+    return AutoModelForCausalLM.from_pretrained(
+        model_config["path"],
+        model_type=model_config["type"],
+        context_length=model_config.get("context_length", 2048),
+        gpu_layers=model_config.get("gpu_layers", 0),
+        **options
+    )
+
+def load_model(model_name: str, model_config: Dict):
+    """Load a model from disk (used by the model registry)"""
     try:
-        with open(status_file, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {"status": ModelStatus.LOADING, "error": None}
+        logger.info("Loading model %s...", model_name)
+        
+        model_path = model_config["path"]
+        
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"Model file not found at {model_path}; download it with `python fetch_model.py {model_name}`"
+            )
+        
+        logger.info("Model file found. Size: %.2f GB", os.path.getsize(model_path) / (1024*1024*1024))
+        if settings.MODEL_PREWARM:
+            logger.info("Prewarmed %s in %.1fs", model_path, prewarm(model_path))
+        # ctransformers reports no progress of its own, so this is coarse
+        model_status_board.update(model_name, progress=0.1)
+        
+        model = create_model(model_config)
+        model_status_board.update(model_name, progress=0.9)
+
+        # Test inference. This pages in the weights before the model is marked
+        # ready, while no request can use it yet.
+        test_response = model("Test", max_new_tokens=1)
+        logger.debug("Test inference successful", extra={"response": test_response})
+        
+        logger.info("Model %s loaded successfully", model_name)
+        return model
+        
+    except Exception:
+        logger.exception("Error loading %s", model_name)
+        raise
 
 class LLMService:
     _instance = None
     _initialized = False
+    _warmup_task = None
+    _warmup_error = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(LLMService, cls).__new__(cls)
-            cls._instance.model = None
-            cls._instance.current_model_name = None
+            cls._instance.registry = ModelRegistry(
+                loader=load_model,
+                memory_budget_bytes=int(settings.MODEL_MEMORY_BUDGET_GB * 1024 ** 3),
+                on_evict=prompt_cache.drop_model,
+                status_board=model_status_board
+            )
+            # With a model host, generations run there instead of in this process
+            cls._instance.remote = (
+                ModelHostClient(settings.MODEL_HOST_SOCKET) if settings.MODEL_HOST_SOCKET else None
+            )
         return cls._instance
 
     def initialize(self):
-        """Initialize the model directly"""
+        """Preload the default model so the first request doesn't pay for it.
+
+        Blocks for the whole load; start_warmup() runs it in the background.
+        """
         if self._initialized:
             return
 
-        print("[LLM] Initializing service...")
+        logger.info("Initializing service...")
         if settings.IS_DEVELOPMENT:
-            model_name = "mistral-7b"
-            try:
-                print(f"[LLM] Loading model {model_name}...")
-                write_status(model_name, ModelStatus.LOADING)
-                
-                model_config = settings.MODELS_CONFIG[model_name]
-                model_path = model_config["path"]
-                
-                if not os.path.exists(model_path):
-                    raise FileNotFoundError(f"Model file not found at {model_path}")
-                
-                print(f"[LLM] Model file found. Size: {os.path.getsize(model_path) / (1024*1024*1024):.2f} GB")
-                
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_path,
-                    model_type=model_config["type"],
-                    context_length=2048,
-                    gpu_layers=0,
-                    batch_size=1,
-                    threads=6
-                )
-                
-                self.current_model_name = model_name
-                print(f"[LLM] Model {model_name} loaded successfully!")
-                
-                # Test inference
-                test_response = self.model("Test")
-                print(f"[LLM] Test inference successful: {test_response[:50]}...")
-                
-                write_status(model_name, ModelStatus.READY)
-                self._initialized = True
-                
-            except Exception as e:
-                error_msg = str(e)
-                print(f"[LLM] Error loading {model_name}: {error_msg}")
-                print("[LLM] Full traceback:")
-                print(traceback.format_exc())
-                write_status(model_name, ModelStatus.ERROR, error_msg)
-                raise
+            with self.registry.use(settings.DEFAULT_MODEL):
+                pass
+        self._initialized = True
+
+    def start_warmup(self):
+        """Run initialize() on a background thread (idempotent, needs a running loop).
 
-    def get_model_status(self, model_name: str) -> Dict[str, str]:
-        """Get the current status of a model"""
-        if self._initialized and self.model is not None and self.current_model_name == model_name:
-            return {"status": ModelStatus.READY, "error": None}
-        return read_status(model_name)
+        Requests that need the model meanwhile wait for it in the inference
+        queue; everything else is served right away.
+        """
+        if self.remote is None and self._warmup_task is None:
+            self._warmup_task = asyncio.get_running_loop().create_task(self._warmup())
 
-    async def get_response(self, message: str, model_name: str, chat_history: list = None) -> str:
-        """Generate a response from the model with chat history context"""
+    async def _warmup(self):
         try:
-            print(f"[LLM] Generating response for message with {len(chat_history) if chat_history else 0} previous messages")
-            
-            if not self._initialized or self.model is None:
-                raise ValueError("Model not initialized")
-            
-            if self.current_model_name != model_name:
-                raise ValueError(f"Requested model {model_name} is not the currently loaded model")
+            await asyncio.to_thread(self.initialize)
+            logger.info("Warmup complete")
+        except Exception as e:
+            self._warmup_error = str(e)
+            logger.error("Warmup failed: %s", self._warmup_error)
 
-            # Limit chat history to last 5 messages to prevent context overflow
-            if chat_history:
-                chat_history = chat_history[-5:]
-                
-            formatted_prompt = ""
-            current_length = 0
-            max_history_chars = 4000  # Reduced from previous value
-            
-            # Add chat history if provided
-            if chat_history:
-                for msg in chat_history:
-                    msg_content = f"[INST] {msg['user_message']} [/INST] {msg['assistant_response']}"
-                    msg_length = len(msg_content)
-                    
-                    if current_length + msg_length > max_history_chars:
-                        print(f"[LLM] Reached history limit at {current_length} characters")
+    async def readiness(self) -> Dict[str, Any]:
+        """Whether startup warmup has finished, for the readiness probe"""
+        if self.remote is not None:
+            try:
+                return await self.remote.readiness()
+            except ModelHostError as e:
+                return {"ready": False, "warming_up": False, "error": str(e)}
+        return {
+            "ready": self._initialized,
+            "warming_up": self._warmup_task is not None and not self._warmup_task.done(),
+            "error": self._warmup_error
+        }
+
+    async def inference_stats(self) -> Dict[str, Any]:
+        """Queue depth and active generations of the executor doing the inference,
+        which is the model host's when there is one"""
+        if self.remote is not None:
+            return await self.remote.inference_stats()
+        return inference_executor.stats()
+
+    def get_model_status(self, model_name: str) -> Dict[str, Any]:
+        """Get the current status of a model (served from memory)"""
+        return self.registry.get_status(model_name)
+
+    def _build_prompt(
+        self,
+        model,
+        model_config: Dict,
+        message: str,
+        chat_history: list = None,
+        summary: Optional[str] = None
+    ) -> str:
+        """Fit the summary and as much recent history as the model's context window allows"""
+        max_tokens = model_config.get("context_length", 2048) - model_config.get("max_new_tokens", 512)
+        prompt = build_prompt(
+            message,
+            chat_history,
+            lambda text: len(model.tokenize(text, add_bos_token=False)),
+            max_tokens,
+            summary
+        )
+        logger.debug("Total prompt length: %d characters", len(prompt))
+        return prompt
+
+    @contextmanager
+    def _use_context(
+        self,
+        model_name: str,
+        chat_id: Optional[int],
+        message: str,
+        chat_history: list = None,
+        summary: Optional[str] = None
+    ) -> Iterator[Tuple[Any, str]]:
+        """Acquire the model and the chat's saved prompt state, and build the prompt.
+
+        Raises ResourceBusy instead of waiting on a resource held by another
+        sequence, which may be running on the same worker thread.
+        """
+        with self.registry.use(model_name, blocking=False) as model:
+            model_config = settings.MODELS_CONFIG[model_name]
+            with prompt_cache.session(
+                model_name,
+                chat_id,
+                model,
+                model_config,
+                lambda: create_model(model_config),
+                blocking=False
+            ) as context_model:
+                prompt = self._build_prompt(model, model_config, message, chat_history, summary)
+                yield context_model, prompt
+
+    def _generate_stream(
+        self,
+        model_name: str,
+        message: str,
+        chat_history: list = None,
+        chat_id: Optional[int] = None,
+        sampling: Optional[Dict] = None,
+        summary: Optional[str] = None,
+        stats: Optional[GenerationStats] = None,
+        deadline: Optional[float] = None
+    ) -> Iterator[Optional[str]]:
+        """Yield text chunks as the model produces them.
+
+        Runs as a scheduler job on an inference worker: it yields WAITING
+        while the model or the chat's context is busy, and None between
+        prompt-evaluation chunks. A `max_new_tokens` entry in sampling
+        overrides the model's default response length. Past the deadline it
+        stops at the next step, and closing it stops it right away; either
+        way the model is free for the next sequence.
+        """
+        sampling = dict(sampling or DEFAULT_SAMPLING)
+        max_new_tokens = sampling.pop("max_new_tokens", settings.MODELS_CONFIG[model_name].get("max_new_tokens", 512))
+        stats = stats if stats is not None else GenerationStats()
+        try:
+            with ExitStack() as stack:
+                while True:
+                    if deadline_passed(deadline):
+                        stats.finish_reason = FinishReason.DEADLINE
+                        return
+                    try:
+                        model, prompt = stack.enter_context(
+                            self._use_context(model_name, chat_id, message, chat_history, summary)
+                        )
                         break
-                        
-                    formatted_prompt += msg_content
-                    current_length += msg_length
-                
-                print(f"[LLM] Included {current_length} characters of chat history")
-            
-            # Add current message
-            formatted_prompt += f"<s>[INST] {message} [/INST]"
+                    except ResourceBusy:
+                        yield WAITING
+
+                # The model only evaluates the part of the prompt not already in its context
+                yield from generate_tokens(
+                    model,
+                    prompt,
+                    max_new_tokens=max_new_tokens,
+                    stop=["</s>"],
+                    prefill_chunk=settings.INFERENCE_PREFILL_CHUNK,
+                    stats=stats,
+                    deadline=deadline,
+                    **sampling
+                )
+        except Exception:
+            stats.finish_reason = FinishReason.ERROR
+            raise
+        finally:
+            if stats.finish_reason is None:
+                stats.finish_reason = FinishReason.CANCELLED
+            _record_generation(model_name, stats)
+            if chat_id is not None:
+                # Counted by generate_tokens, which tokenized the prompt anyway
+                prompt_cache.record_prompt(stats.cached_prompt_tokens, stats.prompt_tokens)
+
+    def _check_model(self, model_name: str):
+        if model_name not in settings.get_available_models():
+            raise ValueError(f"Model {model_name} is not available")
+
+    def _response_cache_key(
+        self,
+        model_name: str,
+        message: str,
+        chat_history: list,
+        sampling: Dict,
+        use_cache: bool,
+        summary: Optional[str] = None
+    ) -> Optional[str]:
+        """Cache key for this request, or None when the cache doesn't apply"""
+        if not (response_cache.enabled and use_cache):
+            return None
+        # The full formatted conversation determines the prompt the model sees
+        turns = [format_turn(msg["user_message"], msg["assistant_response"]) for msg in chat_history or []]
+        return response_cache.make_key(model_name, format_prompt(turns, message, summary), sampling)
+
+    async def get_response(
+        self,
+        message: str,
+        model_name: str,
+        chat_history: list = None,
+        chat_id: Optional[int] = None,
+        sampling: Optional[Dict] = None,
+        use_cache: bool = False,
+        summary: Optional[str] = None,
+        stats: Optional[GenerationStats] = None,
+        user_id: Optional[int] = None
+    ) -> str:
+        """Generate a response from the model with chat history context.
+
+        History items without a `token_count` get one filled in while the
+        prompt is built, so the caller can persist it. `summary` stands in for
+        the chat's messages before the history. With use_cache an identical
+        earlier request may be answered from the response cache.
+
+        Pass stats to learn how the generation finished: a response cut off
+        by the model's deadline is returned as it is, with finish_reason
+        "deadline"; GenerationTimeout is raised when there is no text at all.
+        With user_id the generation is charged to that user's fair share,
+        and QuotaExceeded raised when it is used up.
+        """
+        stats = stats if stats is not None else GenerationStats()
+        try:
+            logger.debug("Generating response for message with %d previous messages", len(chat_history or []))
             
-            print(f"[LLM] Total prompt length: {len(formatted_prompt)} characters")
+            self._check_model(model_name)
             
-            # Add timeout protection
+            # Build the prompt and generate on the inference workers (or the
+            # model host), where the model's tokenizer is available
             try:
-                response = self.model(
-                    formatted_prompt,
-                    max_new_tokens=512,
-                    temperature=0.7,
-                    stop=["</s>"]
+                chunks = await self._open_stream(
+                    message, model_name, chat_history, chat_id, sampling, use_cache, summary, stats, user_id
                 )
-                print(f"[LLM] Generated response successfully")
-                return response.strip()
+                response = "".join([chunk async for chunk in chunks]).strip()
+            except (QueueFullError, QuotaExceeded, PromptTooLong):
+                raise
             except Exception as e:
-                print(f"[LLM] Error during model inference: {str(e)}")
+                logger.error("Error during model inference: %s", e)
                 raise ValueError("Model inference failed - please try again")
+
+            if not response and stats.finish_reason == FinishReason.DEADLINE:
+                raise GenerationTimeout(f"No response from {model_name} within {generation_timeout(model_name)}s")
+            logger.debug("Generated response", extra={"finish_reason": stats.finish_reason})
+            return response
                 
+        except (QueueFullError, QuotaExceeded, GenerationTimeout, PromptTooLong):
+            raise
         except Exception as e:
-            print(f"[LLM] Error generating response: {str(e)}")
-            print("[LLM] Full traceback:")
-            print(traceback.format_exc())
+            logger.exception("Error generating response")
             raise ValueError(f"Error generating response: {str(e)}")
 
+    async def stream_response(
+        self,
+        message: str,
+        model_name: str,
+        chat_history: list = None,
+        chat_id: Optional[int] = None,
+        sampling: Optional[Dict] = None,
+        use_cache: bool = False,
+        summary: Optional[str] = None,
+        stats: Optional[GenerationStats] = None,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Queue a streaming generation and return an async iterator of text chunks.
+
+        Validation and queue admission happen up front, so ValueError,
+        QueueFullError and QuotaExceeded are raised before the first chunk is
+        produced. The stream ends early at the model's deadline; stats, when
+        given, has the finish reason once the stream is exhausted.
+        """
+        logger.debug("Streaming response for message with %d previous messages", len(chat_history or []))
+        return await self._open_stream(
+            message, model_name, chat_history, chat_id, sampling, use_cache, summary, stats, user_id
+        )
+
+    async def _open_stream(
+        self,
+        message: str,
+        model_name: str,
+        chat_history: list = None,
+        chat_id: Optional[int] = None,
+        sampling: Optional[Dict] = None,
+        use_cache: bool = False,
+        summary: Optional[str] = None,
+        stats: Optional[GenerationStats] = None,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        stats = stats if stats is not None else GenerationStats()
+        if self.remote is not None:
+            return await self.remote.stream_response(
+                message, model_name, chat_history, chat_id, sampling, use_cache, summary, stats, user_id
+            )
+
+        self._check_model(model_name)
+        sampling = sampling or DEFAULT_SAMPLING
+        # Covers the time in the queue as well
+        deadline = time.monotonic() + generation_timeout(model_name)
+
+        cache_key = self._response_cache_key(model_name, message, chat_history, sampling, use_cache, summary)
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Serving response from cache")
+                stats.finish_reason = FinishReason.STOP
+                return _single_chunk(cached)
+
+        # Cached answers are free; everything else counts against the user's share
+        cost = estimate_tokens(model_name, message, chat_history, summary, sampling)
+        fair_share.charge(user_id, cost)
+        try:
+            stream = inference_executor.stream(
+                self._generate_stream, model_name, message, chat_history, chat_id, sampling, summary,
+                stats, deadline,
+                share=Share(user_id, cost, fair_share.weight(user_id))
+            )
+        except BaseException:
+            fair_share.settle(user_id, cost, 0)
+            raise
+        chunks = _settle_when_done(_timed(stream, model_name), user_id, cost, stats)
+        if cache_key:
+            chunks = _cache_when_complete(chunks, cache_key, stats)
+
+        async def close_unread():
+            # None of the wrappers above started, so their cleanup never runs
+            await stream.aclose()
+            fair_share.settle(user_id, cost, stats.prompt_tokens + stats.completion_tokens)
+
+        return ClosingStream(chunks, close_unread)
+
+def _record_generation(model_name: str, stats: GenerationStats):
+    """Export a generation's token counts and compute times"""
+    GENERATIONS.inc(model=model_name, finish_reason=stats.finish_reason)
+    PROMPT_TOKENS.inc(stats.prompt_tokens, model=model_name)
+    COMPLETION_TOKENS.inc(stats.completion_tokens, model=model_name)
+    if stats.prompt_tokens:
+        PROMPT_EVAL_SECONDS.observe(stats.prompt_eval_seconds, model=model_name)
+    if stats.completion_tokens and stats.decode_seconds > 0:
+        TOKENS_PER_SECOND.observe(stats.completion_tokens / stats.decode_seconds, model=model_name)
+
+async def _timed(chunks: AsyncIterator[str], model_name: str) -> AsyncIterator[str]:
+    """Pass chunks through, recording time to first chunk and total time"""
+    started = time.perf_counter()
+    first = True
+    try:
+        async for chunk in chunks:
+            if first:
+                TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, model=model_name)
+                first = False
+            yield chunk
+    finally:
+        # Closing this stream early must stop the generation right away
+        await chunks.aclose()
+    GENERATION_SECONDS.observe(time.perf_counter() - started, model=model_name)
+
+async def _settle_when_done(
+    chunks: AsyncIterator[str],
+    user_id: Optional[int],
+    cost: int,
+    stats: GenerationStats
+) -> AsyncIterator[str]:
+    """Pass chunks through, then settle the user's estimated charge to the
+    tokens the generation actually evaluated and produced"""
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+        fair_share.settle(user_id, cost, stats.prompt_tokens + stats.completion_tokens)
+
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    yield text
+
+async def _cache_when_complete(
+    chunks: AsyncIterator[str],
+    cache_key: str,
+    stats: GenerationStats
+) -> AsyncIterator[str]:
+    """Pass chunks through and cache the full response if the model finished it"""
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    finally:
+        await chunks.aclose()
+    if not stats.partial:
+        response_cache.put(cache_key, "".join(parts).strip())
+
 # Global instance
 llm_service = LLMService()
 
-async def get_llm_response(message: str, model_name: str, chat_history: list = None) -> str:
+async def get_llm_response(
+    message: str,
+    model_name: str,
+    chat_history: list = None,
+    chat_id: Optional[int] = None,
+    sampling: Optional[Dict] = None,
+    use_cache: bool = False,
+    summary: Optional[str] = None,
+    stats: Optional[GenerationStats] = None,
+    user_id: Optional[int] = None
+) -> str:
     """Helper function to get response from LLM service"""
     try:
-        return await llm_service.get_response(message, model_name, chat_history)
+        return await llm_service.get_response(
+            message, model_name, chat_history, chat_id, sampling, use_cache, summary, stats, user_id
+        )
+    except (QueueFullError, QuotaExceeded, GenerationTimeout, PromptTooLong):
+        raise
     except Exception as e:
-        print(f"[LLM] Error in get_llm_response: {str(e)}")
-        print("[LLM] Full traceback:")
-        print(traceback.format_exc())
+        logger.exception("Error in get_llm_response")
         raise ValueError(f"Failed to generate response: {str(e)}")
\ No newline at end of file
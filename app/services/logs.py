@@ -0,0 +1,210 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services.metrics import metrics
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    "lemtosh_log_records_dropped_total",
+    "Log records dropped because the log queue was full"
+)
+
+# Fields carrying user or model text; redacted to their length unless
+# LOG_REDACT_MESSAGES is off, and truncated like every other field otherwise
+SENSITIVE_FIELDS = {"user_message", "prompt", "response"}
+
+# Attributes every LogRecord has; anything else was passed in `extra`.
+# uvicorn adds color_message, a duplicate of the message.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "color_message"}
+
+# Per-request state, set by LogContextMiddleware
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_request_id", default=None)
+_sampled: contextvars.ContextVar[bool] = contextvars.ContextVar("log_sampled", default=True)
+
+def parse_sample_rates(spec: str) -> List[Tuple[str, float]]:
+    """Parse "/api/chats=0.1,/health=0" into (path prefix, rate) pairs, longest prefix first"""
+    rates = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        prefix, _, rate = item.partition("=")
+        rates.append((prefix.strip(), min(1.0, max(0.0, float(rate)))))
+    return sorted(rates, key=lambda pair: len(pair[0]), reverse=True)
+
+def _clean(key: str, value: Any, redact: bool, max_length: int) -> Any:
+    if isinstance(value, str):
+        if redact and key in SENSITIVE_FIELDS:
+            return f"<{len(value)} chars>"
+        if len(value) > max_length:
+            return f"{value[:max_length]}...<{len(value)} chars>"
+    return value
+
+class _StructuredFormatter(logging.Formatter):
+    """Base for formatters that render `extra` fields, redacted and truncated.
+
+    Runs on the log listener thread, so none of this work is done by the
+    request that logged the record.
+    """
+
+    def __init__(self, redact: bool, max_length: int):
+        super().__init__()
+        self.redact = redact
+        self.max_length = max_length
+
+    def fields(self, record: logging.LogRecord) -> Dict[str, Any]:
+        return {
+            key: _clean(key, value, self.redact, self.max_length)
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith("_")
+        }
+
+class JSONFormatter(_StructuredFormatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **self.fields(record)
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(_StructuredFormatter):
+    """Human readable lines with key=value fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        line = f"{timestamp} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = self.fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class _ContextFilter(logging.Filter):
+    """Tags records with the request id and drops those of unsampled requests.
+
+    Warnings and errors are always kept.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not _sampled.get():
+            return False
+        request_id = _request_id.get()
+        if request_id is not None:
+            record.request_id = request_id
+        return True
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller.
+
+    Records are formatted on the listener thread rather than here, and are
+    dropped (and counted) when the queue is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+class LogContextMiddleware:
+    """ASGI middleware deciding per request whether its logs are kept.
+
+    The rate comes from the longest LOG_SAMPLE_RATES prefix matching the
+    path (1 when none matches), so chatty routes like health checks can be
+    thinned out without losing their warnings and errors.
+    """
+
+    def __init__(self, app, sample_rates: Optional[List[Tuple[str, float]]] = None):
+        self.app = app
+        self.sample_rates = (
+            sample_rates if sample_rates is not None else parse_sample_rates(settings.LOG_SAMPLE_RATES)
+        )
+
+    def sample_rate(self, path: str) -> float:
+        for prefix, rate in self.sample_rates:
+            if path.startswith(prefix):
+                return rate
+        return 1.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rate = self.sample_rate(scope["path"])
+        request_token = _request_id.set(uuid.uuid4().hex[:12])
+        sampled_token = _sampled.set(rate >= 1.0 or random.random() < rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _sampled.reset(sampled_token)
+            _request_id.reset(request_token)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging():
+    """Send all logging, including uvicorn's, through a background thread (idempotent).
+
+    Callers only put records on a bounded queue; formatting and writing to
+    stderr happen on the listener thread, so a slow log sink can't stall
+    the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter_class = JSONFormatter if settings.LOG_FORMAT == "json" else TextFormatter
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter_class(settings.LOG_REDACT_MESSAGES, settings.LOG_MAX_FIELD_LENGTH))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    # LOG_LEVEL=DEBUG is for this app; libraries' debug output is far too chatty
+    level = logging.getLevelName(settings.LOG_LEVEL.upper())
+    valid_level = isinstance(level, int)
+    if not valid_level:
+        level = logging.INFO
+    root.setLevel(max(level, logging.INFO))
+    logging.getLogger("app").setLevel(level)
+
+    # uvicorn installs its own synchronous handlers; use ours instead
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    if not valid_level:
+        logging.getLogger(__name__).warning("Unknown LOG_LEVEL %r, using INFO", settings.LOG_LEVEL)
+
+def shutdown_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
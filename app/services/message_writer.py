@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import SessionLocal
+from app.services.chat import save_chat_messages
+
+logger = logging.getLogger(__name__)
+
+class _QueuedMessage(NamedTuple):
+    chat_id: int
+    user_message: str
+    assistant_response: str
+    finish_reason: Optional[str]
+    token_counts: Dict[int, int]
+
+_STOP = object()
+
+class MessageWriter:
+    """Saves chat messages, optionally write-behind with group commits.
+
+    Disabled, save() writes and commits before returning. Enabled, save()
+    only queues the message and a background task saves whatever has queued
+    up in one transaction, at most flush_interval after the first message of
+    a batch or as soon as max_batch messages are waiting. Concurrent
+    generations then share one commit instead of queueing on the database
+    lock, and responses don't wait for the disk. Messages still queued when
+    the process dies are lost; stop() saves them on a clean shutdown.
+
+    Readers that must see a chat's latest messages call sync() first.
+    """
+
+    def __init__(self, enabled: bool, max_batch: int, flush_interval: float, max_queue_size: int):
+        self.enabled = enabled
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, int] = {}
+        self._flushed: Optional[asyncio.Condition] = None
+        self.batches = 0
+        self.messages = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the background writer (idempotent, no-op when disabled, needs a running loop)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._flushed = asyncio.Condition()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Save everything queued so far, then stop the background writer"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def save(
+        self,
+        db: AsyncSession,
+        chat_id: int,
+        user_message: str,
+        assistant_response: str,
+        finish_reason: Optional[str] = None,
+        token_counts: Optional[Dict[int, int]] = None
+    ):
+        """Save a message pair, how its response finished, and token counts
+        computed for earlier messages.
+
+        Without the background writer this uses db and commits right away.
+        Otherwise it returns once the message is queued, waiting only if the
+        queue is full.
+        """
+        if self._task is None:
+            await save_chat_messages(
+                db, [(chat_id, user_message, assistant_response, finish_reason)], token_counts or {}
+            )
+            return
+        await self._queue.put(
+            _QueuedMessage(chat_id, user_message, assistant_response, finish_reason, token_counts or {})
+        )
+        # Counted only once queued, so a save cancelled while the queue is
+        # full can't leave sync() waiting forever. The writer can't take the
+        # message before this runs, since nothing is awaited in between.
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+
+    async def sync(self, chat_id: int):
+        """Wait until the chat's queued messages are saved"""
+        if self._task is None or not self._pending.get(chat_id):
+            return
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: not self._pending.get(chat_id))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[_QueuedMessage]):
+        try:
+            try:
+                await self._save(batch)
+            except Exception as e:
+                # Don't lose the whole batch to one bad message
+                logger.warning("Group commit of %d messages failed, saving one by one: %s", len(batch), e)
+                for message in batch:
+                    try:
+                        await self._save([message])
+                    except Exception:
+                        self.failed += 1
+                        logger.exception("Saving a message of chat %d failed", message.chat_id)
+        finally:
+            for message in batch:
+                self._pending[message.chat_id] -= 1
+                if not self._pending[message.chat_id]:
+                    del self._pending[message.chat_id]
+            async with self._flushed:
+                self._flushed.notify_all()
+
+    async def _save(self, batch: List[_QueuedMessage]):
+        token_counts: Dict[int, int] = {}
+        for message in batch:
+            token_counts.update(message.token_counts)
+        async with SessionLocal() as db:
+            await save_chat_messages(
+                db,
+                [
+                    (message.chat_id, message.user_message, message.assistant_response, message.finish_reason)
+                    for message in batch
+                ],
+                token_counts
+            )
+        self.batches += 1
+        self.messages += len(batch)
+
+    def stats(self):
+        return {
+            "enabled": self._task is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "messages": self.messages,
+            "failed": self.failed
+        }
+
+# Global instance
+message_writer = MessageWriter(
+    enabled=settings.WRITE_BEHIND_ENABLED,
+    max_batch=settings.WRITE_BEHIND_MAX_BATCH,
+    flush_interval=settings.WRITE_BEHIND_FLUSH_MS / 1000,
+    max_queue_size=settings.WRITE_BEHIND_QUEUE_SIZE
+)
@@ -0,0 +1,291 @@
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Seconds; covers fast DB queries up to long generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Base for metrics with a fixed set of label names.
+
+    Updates take one short lock, so they are cheap and safe from the
+    inference and password hashing worker threads.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """Exposition lines, or none while nothing has been recorded.
+
+        Leaving out empty metrics lets a model host's metrics be appended to
+        an API worker's without repeating a metric family.
+        """
+        samples = self._samples()
+        if not samples:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + samples
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (non-cumulative) + overflow, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Run collector before every render, e.g. to set gauges from live state"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collector in collectors:
+            collector()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Global instance
+metrics = MetricsRegistry()
+
+# Generation
+GENERATIONS = metrics.counter(
+    "lemtosh_generations_total",
+    "Generations by how they finished; deadline and cancelled ones are partial",
+    ["model", "finish_reason"]
+)
+TIME_TO_FIRST_TOKEN = metrics.histogram(
+    "lemtosh_time_to_first_token_seconds",
+    "Time from queueing a generation to its first text chunk",
+    ["model"]
+)
+GENERATION_SECONDS = metrics.histogram(
+    "lemtosh_generation_seconds",
+    "Time from queueing a generation to its last text chunk",
+    ["model"]
+)
+PROMPT_EVAL_SECONDS = metrics.histogram(
+    "lemtosh_prompt_eval_seconds",
+    "Compute time spent evaluating the uncached part of the prompt",
+    ["model"]
+)
+TOKENS_PER_SECOND = metrics.histogram(
+    "lemtosh_tokens_per_second",
+    "Completion tokens per second of decode compute time",
+    ["model"],
+    buckets=RATE_BUCKETS
+)
+PROMPT_TOKENS = metrics.counter(
+    "lemtosh_prompt_tokens_total",
+    "Prompt tokens evaluated (excluding tokens reused from the context)",
+    ["model"]
+)
+COMPLETION_TOKENS = metrics.counter(
+    "lemtosh_completion_tokens_total",
+    "Completion tokens generated",
+    ["model"]
+)
+
+# Models and inference queue
+MODEL_LOAD_SECONDS = metrics.histogram(
+    "lemtosh_model_load_seconds",
+    "Time to load a model",
+    ["model"]
+)
+INFERENCE_QUEUE_DEPTH = metrics.gauge(
+    "lemtosh_inference_queue_depth",
+    "Generations waiting for an inference worker"
+)
+INFERENCE_ACTIVE = metrics.gauge(
+    "lemtosh_inference_active",
+    "Generations running on the inference workers"
+)
+QUOTA_REJECTIONS = metrics.counter(
+    "lemtosh_quota_rejections_total",
+    "Generations refused because the user's token bucket was empty"
+)
+
+# Database and HTTP
+DB_QUERY_SECONDS = metrics.histogram(
+    "lemtosh_db_query_seconds",
+    "Time spent in database service functions",
+    ["function"]
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "lemtosh_http_request_seconds",
+    "HTTP request latency until the response is complete",
+    ["method", "route", "status"]
+)
+
+def timed_db(fn: Callable) -> Callable:
+    """Record the duration of an async database service function"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, function=fn.__name__)
+    return wrapper
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware recording request latency per route template.
+
+    Requests that match no route share one label, so unknown paths can't
+    blow up the number of series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code)
+            )
@@ -0,0 +1,335 @@
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bytes per read while downloading, hashing and prewarming
+_BLOCK = 1024 * 1024
+
+class DownloadError(Exception):
+    """Raised when a model file can't be downloaded or fails verification"""
+
+class _DownloadAborted(Exception):
+    """A range stopped partway because another one failed"""
+
+class _RecordingRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows redirects, keeping the headers of each redirect response"""
+
+    def __init__(self):
+        self.redirect_headers = []
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.redirect_headers.append(headers)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+def _linked_file(headers_list) -> Tuple[Optional[int], Optional[str]]:
+    """Size and SHA-256 that Hugging Face sends for LFS files with the redirect
+    to their storage (X-Linked-Size and X-Linked-Etag)"""
+    for headers in headers_list:
+        sha256 = headers.get("X-Linked-Etag", "").strip('"').lower()
+        size = headers.get("X-Linked-Size", "")
+        if len(sha256) == 64 and all(c in "0123456789abcdef" for c in sha256):
+            return (int(size) if size.isdigit() else None), sha256
+    return None, None
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(_BLOCK * 8)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def prewarm(path: str) -> float:
+    """Read a file through the page cache, so loading it doesn't wait for the disk.
+
+    Models are memory-mapped; without this the first requests fault the
+    weights in from disk piece by piece. Returns the seconds it took.
+    """
+    started = time.perf_counter()
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            # Lets the kernel read ahead in large sequential requests
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        buffer = bytearray(_BLOCK * 8)
+        while f.readinto(buffer):
+            pass
+    return time.perf_counter() - started
+
+class ModelDownloader:
+    """Downloads large files with parallel HTTP range requests.
+
+    The file is split into chunk_bytes ranges that `connections` threads
+    fetch into <destination>.part. Completed ranges are recorded in
+    <destination>.part.json, so an interrupted download resumes where it
+    stopped, and a dropped connection is retried from the last byte
+    received. Servers without range support get one sequential download.
+
+    Once complete, the size and SHA-256 are checked and the file is renamed
+    into place, so the destination either doesn't exist or is complete.
+    Expected values not passed in are taken from the server when it
+    publishes them (Hugging Face does, for its model files).
+    """
+
+    def __init__(self, connections: int, chunk_bytes: int, timeout: float, retries: int):
+        self.connections = max(1, connections)
+        self.chunk_bytes = max(_BLOCK, chunk_bytes)
+        self.timeout = timeout
+        self.retries = retries
+
+    def _open(
+        self,
+        url: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        redirects: Optional[_RecordingRedirectHandler] = None
+    ):
+        request = urllib.request.Request(url, headers={"User-Agent": "lemtosh-model-download"})
+        if start is not None:
+            request.add_header("Range", f"bytes={start}-{end}")
+        opener = urllib.request.build_opener(redirects or urllib.request.HTTPRedirectHandler())
+        return opener.open(request, timeout=self.timeout)
+
+    def probe(self, url: str) -> Tuple[Optional[int], bool, Optional[str]]:
+        """Size of the file (None if the server doesn't say), whether ranges
+        are served, and the SHA-256 the server publishes for it, if any"""
+        redirects = _RecordingRedirectHandler()
+        with self._open(url, 0, 0, redirects) as response:
+            linked_size, linked_sha256 = _linked_file(redirects.redirect_headers + [response.headers])
+            if response.status == 206:
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                if total.isdigit():
+                    return int(total), True, linked_sha256
+            length = response.headers.get("Content-Length", "")
+            return (int(length) if length.isdigit() else linked_size), False, linked_sha256
+
+    def download(
+        self,
+        url: str,
+        destination: str,
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None
+    ) -> str:
+        """Download url to destination, verifying its size and SHA-256.
+
+        progress(bytes done, total bytes) is called from the download
+        threads as data arrives.
+        """
+        total, ranged, published_sha256 = self.probe(url)
+        if size is not None and total is not None and total != size:
+            raise DownloadError(f"{url} is {total} bytes, expected {size}")
+        total = total if total is not None else size
+        if sha256 and published_sha256 and sha256.lower() != published_sha256:
+            raise DownloadError(f"{url} has SHA-256 {published_sha256}, expected {sha256.lower()}")
+        sha256 = sha256 or published_sha256
+        if not sha256:
+            logger.warning("No SHA-256 known for %s, only its size will be checked", url)
+
+        directory = os.path.dirname(destination)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        part = f"{destination}.part"
+        state_path = f"{part}.json"
+
+        started = time.perf_counter()
+        if ranged and total:
+            self._download_ranges(url, part, state_path, total, progress)
+        else:
+            logger.info("Server doesn't serve ranges, downloading %s in one piece", url)
+            self._download_whole(url, part, progress)
+        logger.info("Downloaded %s in %.1fs", url, time.perf_counter() - started)
+
+        self._verify(part, state_path, total, sha256)
+        os.replace(part, destination)
+        if os.path.exists(state_path):
+            os.unlink(state_path)
+        return destination
+
+    def _load_state(self, part: str, state_path: str, url: str, total: int) -> Dict:
+        """Progress of an earlier attempt at the same download, or a fresh start"""
+        if os.path.exists(part) and os.path.exists(state_path):
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+                if state["url"] == url and state["size"] == total:
+                    logger.info("Resuming download, %d chunks already done", len(state["done"]))
+                    return state
+            except (ValueError, KeyError):
+                pass
+        with open(part, "wb") as f:
+            f.truncate(total)
+        return {"url": url, "size": total, "chunk_bytes": self.chunk_bytes, "done": []}
+
+    def _download_ranges(
+        self,
+        url: str,
+        part: str,
+        state_path: str,
+        total: int,
+        progress: Optional[Callable[[int, Optional[int]], None]]
+    ):
+        state = self._load_state(part, state_path, url, total)
+        chunk_bytes = state["chunk_bytes"]
+        done: Set[int] = set(state["done"])
+        chunks = [
+            (index, start, min(start + chunk_bytes, total) - 1)
+            for index, start in enumerate(range(0, total, chunk_bytes))
+        ]
+        lock = threading.Lock()
+        failed = threading.Event()
+        received = [sum(end - start + 1 for index, start, end in chunks if index in done)]
+
+        def on_bytes(count: int):
+            with lock:
+                received[0] += count
+                if progress is not None:
+                    progress(received[0], total)
+
+        def fetch(index: int, start: int, end: int):
+            if failed.is_set():
+                return
+            try:
+                self._fetch_range(url, part, start, end, on_bytes, failed)
+            except _DownloadAborted:
+                return
+            except BaseException:
+                failed.set()
+                raise
+            with lock:
+                done.add(index)
+                state["done"] = sorted(done)
+                self._save_state(state_path, state)
+
+        with ThreadPoolExecutor(self.connections, thread_name_prefix="model-download") as pool:
+            futures = [pool.submit(fetch, *chunk) for chunk in chunks if chunk[0] not in done]
+        # Raises the first failure, once every thread has stopped
+        for future in futures:
+            future.result()
+        if len(done) != len(chunks):
+            raise DownloadError(f"Only {len(done)} of {len(chunks)} chunks were downloaded")
+
+    def _save_state(self, state_path: str, state: Dict):
+        temporary = f"{state_path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, state_path)
+
+    def _fetch_range(
+        self,
+        url: str,
+        part: str,
+        start: int,
+        end: int,
+        on_bytes: Callable[[int], None],
+        failed: threading.Event
+    ):
+        """Write bytes start..end (inclusive) into the part file, retrying from where a connection broke.
+
+        Raises _DownloadAborted when it stops early because another range failed.
+        """
+        position = start
+        for attempt in range(self.retries + 1):
+            try:
+                with self._open(url, position, end) as response, open(part, "r+b") as f:
+                    if response.status != 206:
+                        raise DownloadError(f"Server ignored the range request for bytes {position}-{end}")
+                    f.seek(position)
+                    while position <= end:
+                        if failed.is_set():
+                            raise _DownloadAborted()
+                        block = response.read(min(_BLOCK, end + 1 - position))
+                        if not block:
+                            raise ConnectionError(f"Connection closed at byte {position} of {start}-{end}")
+                        f.write(block)
+                        position += len(block)
+                        on_bytes(len(block))
+                    # The chunk is only recorded as done once it is on disk
+                    f.flush()
+                    os.fsync(f.fileno())
+                return
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    raise DownloadError(f"Downloading bytes {start}-{end} failed: {e}")
+                logger.warning("Range %d-%d interrupted at %d, retrying: %s", start, end, position, e)
+                time.sleep(min(2 ** attempt, 30))
+
+    def _download_whole(
+        self,
+        url: str,
+        part: str,
+        progress: Optional[Callable[[int, Optional[int]], None]]
+    ):
+        received = 0
+        with self._open(url) as response, open(part, "wb") as f:
+            length = response.headers.get("Content-Length", "")
+            total = int(length) if length.isdigit() else None
+            while True:
+                block = response.read(_BLOCK)
+                if not block:
+                    break
+                f.write(block)
+                received += len(block)
+                if progress is not None:
+                    progress(received, total)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _verify(self, part: str, state_path: str, size: Optional[int], sha256: Optional[str]):
+        """Check the finished file; a corrupt one is deleted so the next attempt starts over"""
+        error = None
+        actual_size = os.path.getsize(part)
+        if size is not None and actual_size != size:
+            error = f"Downloaded {actual_size} bytes, expected {size}"
+        elif sha256:
+            actual = file_sha256(part)
+            if actual != sha256.lower():
+                error = f"SHA-256 mismatch: got {actual}, expected {sha256.lower()}"
+        if error:
+            for path in (part, state_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise DownloadError(error)
+
+def fetch_model(
+    model_id: str,
+    downloader: Optional[ModelDownloader] = None,
+    force: bool = False,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None
+) -> str:
+    """Download a model's file from its config's download_url to its path.
+
+    Verifies the config's optional size_bytes and sha256. An existing file
+    is kept unless force is set. Returns the path.
+    """
+    config = settings.MODELS_CONFIG.get(model_id)
+    if config is None:
+        raise ValueError(f"Unknown model {model_id}")
+    path = config["path"]
+    if os.path.exists(path) and not force:
+        logger.info("%s already exists", path)
+        return path
+    logger.info("Downloading %s to %s", model_id, path)
+    return (downloader or model_downloader).download(
+        config["download_url"], path, config.get("size_bytes"), config.get("sha256"), progress
+    )
+
+# Global instance
+model_downloader = ModelDownloader(
+    connections=settings.MODEL_DOWNLOAD_CONNECTIONS,
+    chunk_bytes=int(settings.MODEL_DOWNLOAD_CHUNK_MB * 1024 ** 2),
+    timeout=settings.MODEL_DOWNLOAD_TIMEOUT,
+    retries=settings.MODEL_DOWNLOAD_RETRIES
+)
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+from app.services.context import PromptTooLong
+from app.services.fair_share import QuotaExceeded
+from app.services.generation import GenerationStats
+from app.services.inference import ClosingStream, QueueFullError
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests carry the chat history, so allow long lines
+_LINE_LIMIT = 16 * 1024 * 1024
+
+class ModelHostError(Exception):
+    """Raised when the model host fails a request or cannot be reached"""
+
+async def _send(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+async def _receive(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    line = await reader.readline()
+    if not line:
+        raise ModelHostError("Model host closed the connection")
+    return json.loads(line)
+
+def _error_reply(error: Exception) -> Dict[str, Any]:
+    if isinstance(error, QueueFullError):
+        return {
+            "event": "error",
+            "type": "queue_full",
+            "queue_depth": error.queue_depth,
+            "retry_after": error.retry_after
+        }
+    if isinstance(error, QuotaExceeded):
+        return {"event": "error", "type": "quota", "retry_after": error.retry_after}
+    if isinstance(error, PromptTooLong):
+        return {"event": "error", "type": "prompt_too_long", "detail": str(error)}
+    if isinstance(error, ValueError):
+        return {"event": "error", "type": "invalid", "detail": str(error)}
+    return {"event": "error", "type": "failed", "detail": str(error)}
+
+def _raise_error(reply: Dict[str, Any]):
+    """Re-raise an error reply as the exception the host raised"""
+    if reply.get("type") == "queue_full":
+        raise QueueFullError(reply["queue_depth"], reply["retry_after"])
+    if reply.get("type") == "quota":
+        raise QuotaExceeded(reply["retry_after"])
+    if reply.get("type") == "prompt_too_long":
+        raise PromptTooLong(reply["detail"])
+    if reply.get("type") == "invalid":
+        raise ValueError(reply["detail"])
+    raise ModelHostError(reply.get("detail", "Model host error"))
+
+class ModelHostClient:
+    """Talks to a model host process over its Unix socket.
+
+    Each request uses its own connection carrying newline-delimited JSON.
+    Errors raised in the host (QueueFullError, QuotaExceeded, PromptTooLong,
+    ValueError) are raised again here, so callers can't tell a remote
+    service from a local one.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    async def _open(self, request: Dict[str, Any]):
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=_LINE_LIMIT)
+        except OSError as e:
+            raise ModelHostError(f"Model host unavailable at {self.socket_path}: {e}")
+        try:
+            await _send(writer, request)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def stream_response(
+        self,
+        message: str,
+        model_name: str,
+        chat_history: list = None,
+        chat_id: Optional[int] = None,
+        sampling: Optional[Dict] = None,
+        use_cache: bool = False,
+        summary: Optional[str] = None,
+        stats: Optional[GenerationStats] = None,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Start a generation on the host and return an async iterator of text chunks.
+
+        Returns once the host has queued the generation, so admission errors
+        are raised here. Token counts the host computed are copied into the
+        chat_history items, and the finish reason into stats, when the stream
+        completes.
+        """
+        reader, writer = await self._open({
+            "op": "generate",
+            "message": message,
+            "model_name": model_name,
+            "chat_history": chat_history,
+            "chat_id": chat_id,
+            "sampling": sampling,
+            "use_cache": use_cache,
+            "summary": summary,
+            "user_id": user_id
+        })
+        try:
+            reply = await _receive(reader)
+            if reply["event"] == "error":
+                _raise_error(reply)
+        except BaseException:
+            writer.close()
+            raise
+
+        async def close_unread():
+            writer.close()
+
+        return ClosingStream(self._iterate(reader, writer, chat_history, stats), close_unread)
+
+    async def _iterate(
+        self,
+        reader,
+        writer,
+        chat_history: Optional[list],
+        stats: Optional[GenerationStats]
+    ) -> AsyncIterator[str]:
+        try:
+            while True:
+                reply = await _receive(reader)
+                if reply["event"] == "token":
+                    yield reply["text"]
+                elif reply["event"] == "done":
+                    for item, token_count in zip(chat_history or [], reply["token_counts"]):
+                        item["token_count"] = token_count
+                    if stats is not None:
+                        stats.finish_reason = reply["finish_reason"]
+                    return
+                else:
+                    _raise_error(reply)
+        finally:
+            # Closing early makes the host stop generating
+            writer.close()
+
+    async def metrics(self) -> str:
+        """The host's metrics in the Prometheus text format"""
+        reader, writer = await self._open({"op": "metrics"})
+        try:
+            reply = await _receive(reader)
+        finally:
+            writer.close()
+        return reply["text"]
+
+    async def readiness(self) -> Dict[str, Any]:
+        reader, writer = await self._open({"op": "ready"})
+        try:
+            reply = await _receive(reader)
+        finally:
+            writer.close()
+        reply.pop("event")
+        return reply
+
+    async def inference_stats(self) -> Dict[str, Any]:
+        """The host's inference queue and workers"""
+        reader, writer = await self._open({"op": "inference"})
+        try:
+            reply = await _receive(reader)
+        finally:
+            writer.close()
+        reply.pop("event")
+        return reply
+
+async def _handle(service, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serve one request from an API worker"""
+    try:
+        request = await _receive(reader)
+        op = request.pop("op")
+        if op == "ready":
+            await _send(writer, {"event": "ready", **(await service.readiness())})
+        elif op == "metrics":
+            await _send(writer, {"event": "metrics", "text": metrics.render()})
+        elif op == "inference":
+            await _send(writer, {"event": "inference", **(await service.inference_stats())})
+        elif op == "generate":
+            await _stream_to(writer, service, request)
+        else:
+            await _send(writer, {"event": "error", "type": "invalid", "detail": f"Unknown op {op}"})
+    except (ConnectionError, ModelHostError):
+        # The API worker went away; nothing left to tell it
+        pass
+    finally:
+        writer.close()
+
+async def _stream_to(writer: asyncio.StreamWriter, service, request: Dict[str, Any]):
+    stats = GenerationStats()
+    try:
+        chunks = await service.stream_response(**request, stats=stats)
+    except Exception as e:
+        await _send(writer, _error_reply(e))
+        return
+    await _send(writer, {"event": "accepted"})
+
+    try:
+        async for chunk in chunks:
+            await _send(writer, {"event": "token", "text": chunk})
+    except ConnectionError:
+        raise
+    except Exception as e:
+        await _send(writer, _error_reply(e))
+        return
+    finally:
+        # Stops the generation if the API worker disconnected
+        await chunks.aclose()
+
+    token_counts = [item.get("token_count") for item in request.get("chat_history") or []]
+    await _send(writer, {"event": "done", "token_counts": token_counts, "finish_reason": stats.finish_reason})
+
+async def serve(service, socket_path: str):
+    """Serve the LLM service to API workers over a Unix socket until cancelled"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _handle(service, reader, writer),
+        path=socket_path,
+        limit=_LINE_LIMIT
+    )
+    os.chmod(socket_path, 0o660)
+    logger.info("Serving models on %s", socket_path)
+    async with server:
+        await server.serve_forever()
+
+def run_model_host(socket_path: str):
+    """Entry point of the model host process.
+
+    Owns the models, the inference workers and the prompt and response
+    caches; API workers started with MODEL_HOST_SOCKET forward generations
+    here, so the models are loaded once however many API workers there are.
+    """
+    from app.services.inference import inference_executor
+    from app.services.llm import llm_service
+    from app.services.logs import setup_logging, shutdown_logging
+    from app.services.model_status import model_status_board
+
+    # This process serves the models itself
+    llm_service.remote = None
+
+    setup_logging()
+
+    async def main():
+        model_status_board.start()
+        inference_executor.start()
+        llm_service.start_warmup()
+        try:
+            await serve(llm_service, socket_path)
+        finally:
+            inference_executor.stop()
+            model_status_board.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        shutdown_logging()
@@ -0,0 +1,230 @@
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from app.config import settings
+from app.services.inference import ResourceBusy
+from app.services.metrics import MODEL_LOAD_SECONDS
+from app.services.model_status import ModelStatus, ModelStatusBoard, current_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+class ModelEntry:
+    """Book-keeping for one model in the registry"""
+
+    def __init__(self, model_id: str, config: Dict[str, Any]):
+        self.model_id = model_id
+        self.config = config
+        self.model = None
+        self.status = ModelStatus.UNLOADED
+        self.error: Optional[str] = None
+        self.size_bytes = 0
+        self.in_flight = 0
+        self.last_used = 0.0
+
+def estimate_model_size(config: Dict[str, Any]) -> int:
+    """Estimate the resident memory of a model in bytes.
+
+    Uses an explicit `memory_gb` from the model config when present,
+    otherwise the size of the model file on disk.
+    """
+    if "memory_gb" in config:
+        return int(config["memory_gb"] * 1024 ** 3)
+    return os.path.getsize(config["path"])
+
+class ModelRegistry:
+    """Loads models on demand and keeps them resident within a memory budget.
+
+    When a model does not fit, the least-recently-used idle models are
+    evicted first. Models with in-flight requests are never evicted; a
+    request that needs the memory waits until they are released. All
+    methods are thread-safe and blocking, so they are meant to be called
+    from inference worker threads.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, Dict[str, Any]], Any],
+        memory_budget_bytes: int,
+        on_evict: Optional[Callable[[str], None]] = None,
+        status_board: Optional[ModelStatusBoard] = None
+    ):
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.on_evict = on_evict
+        # A ModelStatusBoard that load progress and usage are reported to
+        self.status_board = status_board
+        self._entries: Dict[str, ModelEntry] = {}
+        self._cond = threading.Condition()
+
+    def _entry(self, model_id: str) -> ModelEntry:
+        entry = self._entries.get(model_id)
+        if entry is None:
+            available_models = settings.get_available_models()
+            if model_id not in available_models:
+                raise ValueError(f"Model {model_id} is not available")
+            entry = ModelEntry(model_id, available_models[model_id])
+            self._entries[model_id] = entry
+        return entry
+
+    def _used_bytes(self) -> int:
+        return sum(
+            entry.size_bytes for entry in self._entries.values()
+            if entry.status in (ModelStatus.LOADING, ModelStatus.READY)
+        )
+
+    def _evict_lru(self, needed_bytes: int) -> bool:
+        """Evict idle models, oldest first, until needed_bytes fit. Caller holds the lock."""
+        idle = sorted(
+            (entry for entry in self._entries.values()
+             if entry.status == ModelStatus.READY and entry.in_flight == 0),
+            key=lambda entry: entry.last_used
+        )
+        for entry in idle:
+            if self._used_bytes() + needed_bytes <= self.memory_budget_bytes:
+                break
+            logger.info("Evicting %s (last used %.0fs ago)", entry.model_id, time.time() - entry.last_used)
+            entry.model = None
+            entry.status = ModelStatus.UNLOADED
+            self._report(entry.model_id, status=ModelStatus.UNLOADED, progress=0.0, rss_bytes=0)
+            if self.on_evict:
+                self.on_evict(entry.model_id)
+        gc.collect()
+        return self._used_bytes() + needed_bytes <= self.memory_budget_bytes
+
+    def _report(self, model_id: str, **fields):
+        if self.status_board is not None:
+            self.status_board.update(model_id, **fields)
+
+    def _wait(self, blocking: bool):
+        if not blocking:
+            raise ResourceBusy()
+        self._cond.wait()
+
+    def acquire(self, model_id: str, blocking: bool = True) -> Any:
+        """Return a loaded model, loading it first if needed, and mark it in use.
+
+        Every successful acquire must be paired with release(). With
+        blocking=False, ResourceBusy is raised instead of waiting for another
+        worker's load or for memory to be released.
+        """
+        with self._cond:
+            entry = self._entry(model_id)
+            while True:
+                if entry.status == ModelStatus.READY:
+                    entry.in_flight += 1
+                    entry.last_used = time.time()
+                    self._report(model_id, last_used=entry.last_used)
+                    return entry.model
+                if entry.status == ModelStatus.LOADING:
+                    # Another worker is loading it - wait instead of failing
+                    self._wait(blocking)
+                    continue
+
+                try:
+                    size_bytes = estimate_model_size(entry.config)
+                except OSError:
+                    entry.status = ModelStatus.ERROR
+                    entry.error = f"Model file not found at {entry.config['path']}"
+                    self._report(model_id, status=ModelStatus.ERROR, error=entry.error)
+                    raise FileNotFoundError(entry.error)
+                if size_bytes > self.memory_budget_bytes:
+                    raise ValueError(
+                        f"Model {model_id} needs {size_bytes / 1024 ** 3:.1f} GB, "
+                        f"more than the {self.memory_budget_bytes / 1024 ** 3:.1f} GB budget"
+                    )
+                if not self._evict_lru(size_bytes):
+                    # Everything else is busy; wait for a release and retry
+                    self._wait(blocking)
+                    continue
+
+                entry.status = ModelStatus.LOADING
+                entry.error = None
+                entry.size_bytes = size_bytes
+                break
+
+        # Load outside the lock so other models stay usable meanwhile
+        started_at = time.time()
+        rss_before = current_rss_bytes()
+        self._report(
+            model_id,
+            status=ModelStatus.LOADING,
+            error=None,
+            progress=0.0,
+            load_started_at=started_at,
+            load_duration=None
+        )
+        try:
+            model = self.loader(model_id, entry.config)
+        except Exception as e:
+            with self._cond:
+                entry.status = ModelStatus.ERROR
+                entry.error = str(e)
+                self._report(model_id, status=ModelStatus.ERROR, error=entry.error)
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            entry.model = model
+            entry.status = ModelStatus.READY
+            entry.in_flight += 1
+            entry.last_used = time.time()
+            MODEL_LOAD_SECONDS.observe(entry.last_used - started_at, model=model_id)
+            # Approximate: concurrent loads of other models count here too
+            self._report(
+                model_id,
+                status=ModelStatus.READY,
+                progress=1.0,
+                load_duration=entry.last_used - started_at,
+                rss_bytes=max(0, current_rss_bytes() - rss_before),
+                last_used=entry.last_used
+            )
+            self._cond.notify_all()
+            return model
+
+    def release(self, model_id: str):
+        """Mark one request against the model as finished"""
+        with self._cond:
+            entry = self._entries[model_id]
+            entry.in_flight -= 1
+            entry.last_used = time.time()
+            self._report(model_id, last_used=entry.last_used)
+            self._cond.notify_all()
+
+    @contextmanager
+    def use(self, model_id: str, blocking: bool = True) -> Iterator[Any]:
+        """Context manager around acquire()/release()"""
+        model = self.acquire(model_id, blocking)
+        try:
+            yield model
+        finally:
+            self.release(model_id)
+
+    def get_status(self, model_id: str) -> Dict[str, Any]:
+        with self._cond:
+            entry = self._entries.get(model_id)
+            in_flight = entry.in_flight if entry else 0
+            if self.status_board is not None:
+                return {**self.status_board.get(model_id), "in_flight": in_flight}
+            if entry is None:
+                return {"status": ModelStatus.UNLOADED, "error": None, "in_flight": 0}
+            return {
+                "status": entry.status,
+                "error": entry.error,
+                "in_flight": in_flight
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "memory_used_bytes": self._used_bytes(),
+                "loaded": [
+                    model_id for model_id, entry in self._entries.items()
+                    if entry.status == ModelStatus.READY
+                ]
+            }
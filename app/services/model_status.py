@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import resource
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class ModelStatus:
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+    ERROR = "error"
+
+# Which record wins when several workers report the same model
+_STATUS_RANK = {
+    ModelStatus.READY: 3,
+    ModelStatus.LOADING: 2,
+    ModelStatus.ERROR: 1,
+    ModelStatus.UNLOADED: 0
+}
+
+def current_rss_bytes() -> int:
+    """Resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: fall back to the peak, which is the best we can get
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _empty_record() -> Dict[str, Any]:
+    return {
+        "status": ModelStatus.UNLOADED,
+        "error": None,
+        "progress": 0.0,
+        "load_started_at": None,
+        "load_duration": None,
+        "rss_bytes": 0,
+        "last_used": None
+    }
+
+class ModelStatusBoard:
+    """Load status, progress and resource use of each model.
+
+    Records are kept in memory. With db_path set, a background thread also
+    publishes them to a small SQLite table every refresh_seconds and reads
+    back the rows of other API worker processes on this host, so every
+    worker can report models loaded by the others. Reads never do I/O.
+    Rows of processes that are no longer running are ignored and removed.
+    """
+
+    def __init__(self, db_path: Optional[str], refresh_seconds: float = 1.0):
+        self.db_path = db_path
+        self.refresh_seconds = refresh_seconds
+        self.pid = os.getpid()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._others: Dict[str, List[Dict[str, Any]]] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def update(self, model_id: str, **fields):
+        """Set fields of this process's record for a model"""
+        with self._lock:
+            record = self._records.setdefault(model_id, _empty_record())
+            record.update(fields)
+            self._dirty.add(model_id)
+
+    def get(self, model_id: str) -> Dict[str, Any]:
+        """The most advanced status of a model across all workers"""
+        with self._lock:
+            candidates = list(self._others.get(model_id, []))
+            if model_id in self._records:
+                candidates.append(dict(self._records[model_id], pid=self.pid))
+        if not candidates:
+            return _empty_record()
+
+        best = max(
+            candidates,
+            key=lambda record: (_STATUS_RANK.get(record["status"], 0), record.get("last_used") or 0)
+        )
+        result = dict(best)
+        result["workers_ready"] = sum(1 for record in candidates if record["status"] == ModelStatus.READY)
+        return result
+
+    def start(self):
+        """Start sharing status with other workers (idempotent, no-op without db_path)"""
+        if not self.db_path or self._thread is not None:
+            return
+        # Worker processes may have been forked after import
+        self.pid = os.getpid()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="model-status", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS model_status ("
+            "model_id TEXT NOT NULL, pid INTEGER NOT NULL, data TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (model_id, pid))"
+        )
+        conn.commit()
+        return conn
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            logger.warning("Status sharing disabled, cannot open %s: %s", self.db_path, e)
+            return
+
+        try:
+            while True:
+                try:
+                    self._sync(conn)
+                except sqlite3.Error as e:
+                    logger.warning("Status sync failed: %s", e)
+                if self._stopped.wait(self.refresh_seconds):
+                    break
+            # This process's models go away with it
+            conn.execute("DELETE FROM model_status WHERE pid = ?", (self.pid,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _sync(self, conn: sqlite3.Connection):
+        """Publish changed records and reload the other workers' rows"""
+        with self._lock:
+            changed = [(model_id, dict(self._records[model_id])) for model_id in self._dirty]
+            self._dirty.clear()
+
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO model_status (model_id, pid, data, updated_at) VALUES (?, ?, ?, ?)",
+            [(model_id, self.pid, json.dumps(record), now) for model_id, record in changed]
+        )
+
+        others: Dict[str, List[Dict[str, Any]]] = {}
+        dead = set()
+        for model_id, pid, data in conn.execute(
+            "SELECT model_id, pid, data FROM model_status WHERE pid != ?", (self.pid,)
+        ):
+            if pid in dead or not _pid_alive(pid):
+                dead.add(pid)
+                continue
+            others.setdefault(model_id, []).append(dict(json.loads(data), pid=pid))
+        if dead:
+            conn.executemany("DELETE FROM model_status WHERE pid = ?", [(pid,) for pid in dead])
+        conn.commit()
+
+        with self._lock:
+            self._others = others
+
+# Global instance
+model_status_board = ModelStatusBoard(
+    db_path=settings.MODEL_STATUS_DB or None,
+    refresh_seconds=settings.MODEL_STATUS_REFRESH
+)
@@ -0,0 +1,183 @@
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from app.config import settings
+from app.services.inference import ResourceBusy
+
+logger = logging.getLogger(__name__)
+
+def estimate_kv_bytes(config: Dict[str, Any]) -> int:
+    """Estimate the KV cache size of one model context in bytes.
+
+    Uses an explicit `kv_cache_mb` from the model config when present,
+    otherwise assumes 128 KB per context token (7B class, f16 cache).
+    """
+    if "kv_cache_mb" in config:
+        return int(config["kv_cache_mb"] * 1024 ** 2)
+    return config.get("context_length", 2048) * 128 * 1024
+
+class PromptState:
+    """A model context whose evaluated tokens belong to one chat"""
+
+    def __init__(self, model_id: str, chat_id: Optional[int], model: Any, size_bytes: int, shared: bool):
+        self.model_id = model_id
+        self.chat_id = chat_id
+        self.model = model
+        self.size_bytes = size_bytes
+        # True when this is the registry's own model instance rather than an extra context
+        self.shared = shared
+        self.in_use = False
+
+class PromptCache:
+    """Per-chat prompt state cache.
+
+    ctransformers models evaluate only the part of a prompt that differs from
+    the tokens already in their context. One context per model means chats
+    served in turn keep overwriting each other, so this keeps an LRU of
+    contexts keyed by chat id. Extra contexts are additional instances of the
+    same model file; the weights are memory-mapped and shared, so each one only
+    costs its KV cache, and their total is capped at max_bytes. Models with GPU
+    layers only ever use their own instance.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._states: "OrderedDict[Tuple[str, Optional[int]], PromptState]" = OrderedDict()
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+        self.tokens_evaluated = 0
+
+    def _extra_bytes(self) -> int:
+        return sum(state.size_bytes for state in self._states.values() if not state.shared)
+
+    def _idle_lru(self, model_id: str) -> Optional[PromptState]:
+        for state in self._states.values():
+            if state.model_id == model_id and not state.in_use:
+                return state
+        return None
+
+    def _checkout(
+        self,
+        model_id: str,
+        chat_id: Optional[int],
+        base_model: Any,
+        config: Dict[str, Any],
+        factory: Callable[[], Any],
+        blocking: bool
+    ) -> PromptState:
+        key = (model_id, chat_id)
+        with self._cond:
+            while True:
+                state = self._states.get(key)
+                if state is not None:
+                    if state.in_use:
+                        # Same chat already generating on another worker
+                        self._wait(blocking)
+                        continue
+                    self._states.move_to_end(key)
+                    state.in_use = True
+                    self.hits += 1
+                    return state
+
+                # The registry's own instance is the first context of every model
+                if not any(s.shared for s in self._states.values() if s.model_id == model_id):
+                    state = PromptState(model_id, chat_id, base_model, estimate_kv_bytes(config), shared=True)
+                    break
+
+                size_bytes = estimate_kv_bytes(config)
+                can_add = config.get("gpu_layers", 0) == 0 and self._extra_bytes() + size_bytes <= self.max_bytes
+                if not can_add:
+                    # Take over the least recently used idle context of this model
+                    state = self._idle_lru(model_id)
+                    if state is None:
+                        self._wait(blocking)
+                        continue
+                    del self._states[(state.model_id, state.chat_id)]
+                    state.chat_id = chat_id
+                    break
+
+                state = PromptState(model_id, chat_id, None, size_bytes, shared=False)
+                break
+
+            self.misses += 1
+            state.in_use = True
+            self._states[key] = state
+
+        if state.model is None:
+            try:
+                logger.info("Creating extra context for %s", model_id)
+                state.model = factory()
+            except Exception:
+                with self._cond:
+                    del self._states[key]
+                    self._cond.notify_all()
+                raise
+        return state
+
+    def _wait(self, blocking: bool):
+        if not blocking:
+            raise ResourceBusy()
+        self._cond.wait()
+
+    def _checkin(self, state: PromptState):
+        with self._cond:
+            state.in_use = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(
+        self,
+        model_id: str,
+        chat_id: Optional[int],
+        base_model: Any,
+        config: Dict[str, Any],
+        factory: Callable[[], Any],
+        blocking: bool = True
+    ) -> Iterator[Any]:
+        """Yield the model context to generate with for this chat.
+
+        Generations without a chat id (summaries and the like) share one
+        context, checked out like a chat's, so they never evaluate into a
+        context a chat is generating with. With blocking=False, ResourceBusy
+        is raised instead of waiting for a context another sequence is using.
+        """
+        state = self._checkout(model_id, chat_id, base_model, config, factory, blocking)
+        try:
+            yield state.model
+        finally:
+            self._checkin(state)
+
+    def record_prompt(self, reused: int, evaluated: int):
+        """Count a chat prompt's tokens the context already held and the ones it had to evaluate"""
+        with self._cond:
+            self.tokens_reused += reused
+            self.tokens_evaluated += evaluated
+
+    def drop_model(self, model_id: str):
+        """Forget all contexts of a model (called when the registry evicts it)"""
+        with self._cond:
+            for key in [key for key in self._states if key[0] == model_id]:
+                del self._states[key]
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            lookups = self.hits + self.misses
+            return {
+                "states": len(self._states),
+                "extra_bytes": self._extra_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "tokens_reused": self.tokens_reused,
+                "tokens_evaluated": self.tokens_evaluated
+            }
+
+# Global instance
+prompt_cache = PromptCache(max_bytes=int(settings.PROMPT_CACHE_MAX_MB * 1024 ** 2))
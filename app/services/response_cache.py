@@ -0,0 +1,78 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+def is_deterministic(sampling: Dict[str, Any]) -> bool:
+    """Whether the same prompt and sampling params always give the same output"""
+    seed = sampling.get("seed")
+    return sampling.get("temperature") == 0 or (seed is not None and seed >= 0)
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so trivially different prompts share an entry"""
+    return " ".join(prompt.split())
+
+class ResponseCache:
+    """Exact-match cache of generated responses with TTL and LRU eviction.
+
+    Keys cover the model, the normalized prompt and the sampling params.
+    Callers decide per request whether a cached answer is acceptable.
+    """
+
+    def __init__(self, enabled: bool, max_entries: int, ttl_seconds: int):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, model_name: str, prompt: str, sampling: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            [model_name, normalize_prompt(prompt), sampling],
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+# Global instance
+response_cache = ResponseCache(
+    enabled=settings.RESPONSE_CACHE_ENABLED,
+    max_entries=settings.RESPONSE_CACHE_SIZE,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL
+)
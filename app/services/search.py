@@ -0,0 +1,162 @@
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.metrics import timed_db
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "chat_messages_fts"
+
+# Whether this process found (or created) the full-text index; set by
+# create_search_index() when the database is initialized
+_available = False
+
+def create_search_index(conn: Connection) -> bool:
+    """Create the full-text index over chat messages if it is missing.
+
+    SQLite gets an FTS5 table using chat_messages as its external content,
+    which save_chat_messages() adds new messages to. Postgres gets a
+    generated tsvector column with a GIN index, which keeps itself up to
+    date. Messages saved before the index existed are added by
+    backfill_search.py. Returns whether search is available.
+    """
+    global _available
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE}
+        ).first()
+        if not exists:
+            try:
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                    "user_message, assistant_response, "
+                    "content='chat_messages', content_rowid='id', tokenize='porter unicode61')"
+                ))
+            except OperationalError as e:
+                logger.warning("SQLite has no FTS5, chat search is disabled: %s", e)
+                _available = False
+                return False
+            if conn.execute(text("SELECT 1 FROM chat_messages LIMIT 1")).first():
+                logger.warning("Created the chat search index; run backfill_search.py to add existing messages")
+    elif dialect == "postgresql":
+        conn.execute(text(
+            "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('english', "
+            "coalesce(user_message, '') || ' ' || coalesce(assistant_response, ''))) STORED"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_chat_messages_search_vector "
+            "ON chat_messages USING GIN (search_vector)"
+        ))
+    else:
+        logger.warning("Chat search is not supported on %s", dialect)
+        _available = False
+        return False
+    _available = True
+    return True
+
+def rebuild_search_index(conn: Connection) -> int:
+    """Re-index every message (the backfill). Returns the number of messages."""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    # Postgres computed the generated column for existing rows when it was added
+    return conn.execute(text("SELECT count(*) FROM chat_messages")).scalar_one()
+
+async def index_messages(db: AsyncSession, messages: List):
+    """Add newly inserted (flushed) messages to the SQLite full-text index.
+
+    Goes in the same transaction as the insert. Messages are never updated
+    or deleted, so the index only needs to follow inserts.
+    """
+    if not _available or not messages or db.get_bind().dialect.name != "sqlite":
+        return
+    await db.execute(
+        text(
+            f"INSERT INTO {FTS_TABLE}(rowid, user_message, assistant_response) "
+            "VALUES (:id, :user_message, :assistant_response)"
+        ),
+        [
+            {"id": message.id, "user_message": message.user_message, "assistant_response": message.assistant_response}
+            for message in messages
+        ]
+    )
+
+def build_match_query(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching messages with every word.
+
+    Each word is quoted, so the user's text can't be a syntax error, and
+    the last one matches as a prefix, for search as you type. None when
+    there are no words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+@timed_db
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    query: str,
+    limit: int,
+    offset: int = 0
+) -> Tuple[List, Optional[int]]:
+    """Find the user's messages matching query, best match first.
+
+    Rows have id, chat_id, chat_title, model_name, created_at and a
+    snippet with the matches in [brackets]. Returns the rows and the offset
+    of the next page (None on the last page). Raises ValueError when the
+    query has no words, and RuntimeError when search isn't available.
+    """
+    if not _available:
+        raise RuntimeError("Chat search is not available")
+
+    if db.get_bind().dialect.name == "sqlite":
+        match = build_match_query(query)
+        if match is None:
+            raise ValueError("Search query has no words")
+        statement = text(
+            "SELECT m.id, m.chat_id, c.title AS chat_title, c.model_name, m.created_at, "
+            f"snippet({FTS_TABLE}, -1, '[', ']', '...', 16) AS snippet "
+            f"FROM {FTS_TABLE} "
+            f"JOIN chat_messages m ON m.id = {FTS_TABLE}.rowid "
+            "JOIN chats c ON c.id = m.chat_id "
+            f"WHERE {FTS_TABLE} MATCH :match AND c.user_id = :user_id "
+            f"ORDER BY bm25({FTS_TABLE}), m.id DESC "
+            "LIMIT :limit OFFSET :offset"
+        ).columns(created_at=DateTime)
+        params = {"match": match}
+    else:
+        if not re.search(r"\w", query):
+            raise ValueError("Search query has no words")
+        statement = text(
+            "SELECT m.id, m.chat_id, c.title AS chat_title, c.model_name, m.created_at, "
+            "ts_headline('english', coalesce(m.user_message, '') || ' ' || coalesce(m.assistant_response, ''), q, "
+            "'StartSel=[, StopSel=], MaxFragments=1, MaxWords=16') AS snippet "
+            "FROM chat_messages m "
+            "JOIN chats c ON c.id = m.chat_id, "
+            "websearch_to_tsquery('english', :query) q "
+            "WHERE m.search_vector @@ q AND c.user_id = :user_id "
+            "ORDER BY ts_rank(m.search_vector, q) DESC, m.id DESC "
+            "LIMIT :limit OFFSET :offset"
+        ).columns(created_at=DateTime)
+        params = {"query": query}
+
+    # One extra row tells whether there is a next page
+    result = await db.execute(statement, {**params, "user_id": user_id, "limit": limit + 1, "offset": offset})
+    rows = list(result.all())
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return rows, next_offset
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+from app.config import settings
+from app.database import SessionLocal
+from app.services.chat import get_chat, get_unsummarized_messages, update_chat_summary
+from app.services.generation import GenerationStats
+from app.services.inference import QueueFullError
+from app.services.llm import llm_service
+from app.services.message_writer import message_writer
+from app.services.model_host import ModelHostError
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTION = (
+    "Update the summary of a conversation between a user and an assistant. "
+    "Keep names, facts, decisions, open questions and the user's preferences; "
+    "leave out pleasantries. Answer with the summary only, at most {words} words."
+)
+
+def _estimate_tokens(text: str) -> int:
+    """Conservative token estimate, for text that hasn't been tokenized"""
+    return len(text) // 3 + 1
+
+def _message_tokens(message) -> int:
+    if message.token_count is not None:
+        return message.token_count
+    return _estimate_tokens(message.user_message) + _estimate_tokens(message.assistant_response) + 8
+
+def build_summary_request(
+    previous_summary: Optional[str],
+    messages: List,
+    max_input_tokens: int,
+    max_summary_tokens: int
+) -> Tuple[str, int]:
+    """Build the instruction that folds messages into the previous summary.
+
+    Takes as many of the oldest messages as fit in max_input_tokens and
+    returns the instruction and the id of the last message it covers. A
+    message too long to fit on its own is clipped.
+    """
+    budget = max_input_tokens - (_estimate_tokens(previous_summary) if previous_summary else 0)
+    included = []
+    for message in messages:
+        tokens = _message_tokens(message)
+        if included and tokens > budget:
+            break
+        budget -= tokens
+        included.append(message)
+
+    parts = [SUMMARY_INSTRUCTION.format(words=max_summary_tokens * 3 // 4)]
+    if previous_summary:
+        parts.append(f"Summary so far:\n{previous_summary}")
+    # Each side of a message gets at most a third of the token budget, in
+    # characters at the 3 per token _estimate_tokens assumes
+    clip = max_input_tokens // 3 * 3
+    transcript = "\n\n".join(
+        f"User: {message.user_message[:clip]}\nAssistant: {message.assistant_response[:clip]}"
+        for message in included
+    )
+    parts.append(f"New messages:\n{transcript}")
+    return "\n\n".join(parts), included[-1].id
+
+class ConversationSummarizer:
+    """Folds the older messages of long chats into a summary on the Chat row.
+
+    Once a chat has more than trigger_messages messages after its summary,
+    all but the keep_recent newest are summarized by the chat's model,
+    together with the previous summary. Prompts are then built from the
+    summary and the messages after it, so their size stays bounded however
+    long the chat gets.
+
+    Compaction runs on a background task, one chat at a time, and only
+    while the inference workers have nothing else to do. Requests never
+    wait for it; until a summary is stored the prompt simply falls back to
+    the most recent history.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        trigger_messages: int,
+        keep_recent: int,
+        max_summary_tokens: int,
+        idle_poll_seconds: float
+    ):
+        self.enabled = enabled
+        self.trigger_messages = trigger_messages
+        self.keep_recent = max(0, min(keep_recent, trigger_messages - 1))
+        self.max_summary_tokens = max_summary_tokens
+        self.idle_poll_seconds = idle_poll_seconds
+        self._pending: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.summarized = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the background task (idempotent, needs a running loop)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def schedule(self, chat_id: int):
+        """Check a chat for compaction once the workers are idle. Cheap to call per message."""
+        if self._task is None:
+            return
+        self._pending.add(chat_id)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                await self._wait_for_idle()
+                chat_id = self._pending.pop()
+                try:
+                    if await self.compact(chat_id):
+                        # Very long chats may need several rounds
+                        self._pending.add(chat_id)
+                except QueueFullError:
+                    self._pending.add(chat_id)
+                    await asyncio.sleep(self.idle_poll_seconds)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Summarizing chat %d failed", chat_id)
+
+    async def _wait_for_idle(self):
+        """Wait until no generation is queued or running, in this process or
+        on the model host when there is one"""
+        while True:
+            try:
+                stats = await llm_service.inference_stats()
+                if stats["queue_depth"] == 0 and stats["active"] == 0:
+                    return
+            except ModelHostError as e:
+                logger.debug("Model host unavailable, waiting to summarize: %s", e)
+            await asyncio.sleep(self.idle_poll_seconds)
+
+    async def compact(self, chat_id: int) -> bool:
+        """Summarize the chat's older messages if it has grown past the trigger.
+
+        Returns whether a new summary was stored.
+        """
+        await message_writer.sync(chat_id)
+        async with SessionLocal() as db:
+            chat = await get_chat(db, chat_id)
+            if chat is None or chat.model_name not in settings.get_available_models():
+                return False
+            model_name = chat.model_name
+            previous_summary = chat.summary
+            previous_message_id = chat.summary_message_id
+            messages, total = await get_unsummarized_messages(
+                db, chat_id, previous_message_id, self.trigger_messages
+            )
+        if total <= self.trigger_messages:
+            return False
+        messages = messages[:total - self.keep_recent]
+
+        model_config = settings.MODELS_CONFIG[model_name]
+        max_input_tokens = (
+            model_config.get("context_length", 2048)
+            - model_config.get("max_new_tokens", 512)
+            - 128  # instruction and prompt formatting
+        )
+        request, summary_message_id = build_summary_request(
+            previous_summary, messages, max_input_tokens, self.max_summary_tokens
+        )
+        # No database session is held while the model works
+        stats = GenerationStats()
+        summary = await llm_service.get_response(
+            request,
+            model_name,
+            sampling={"temperature": 0.0, "max_new_tokens": self.max_summary_tokens},
+            stats=stats
+        )
+        if not summary or stats.partial:
+            return False
+
+        async with SessionLocal() as db:
+            stored = await update_chat_summary(db, chat_id, summary, summary_message_id, previous_message_id)
+        if stored:
+            self.summarized += 1
+            logger.info("Summarized chat %d through message %d", chat_id, summary_message_id)
+        return stored
+
+    def stats(self):
+        return {
+            "enabled": self._task is not None,
+            "pending": len(self._pending),
+            "summarized": self.summarized,
+            "failed": self.failed
+        }
+
+# Global instance
+conversation_summarizer = ConversationSummarizer(
+    enabled=settings.SUMMARY_ENABLED,
+    trigger_messages=settings.SUMMARY_TRIGGER_MESSAGES,
+    keep_recent=settings.SUMMARY_KEEP_RECENT,
+    max_summary_tokens=settings.SUMMARY_MAX_TOKENS,
+    idle_poll_seconds=settings.SUMMARY_IDLE_POLL
+)
@@ -0,0 +1,26 @@
+"""
+Add the messages of an existing database to the chat search index:
+
+    python backfill_search.py
+
+Creates the index if it is missing, then re-indexes every message. Safe to
+run again; new messages are indexed as they are saved.
+"""
+import asyncio
+
+from app.database import engine
+from app.migrations import init_db
+from app.services.search import create_search_index, rebuild_search_index
+
+async def main():
+    await init_db(engine)
+    async with engine.begin() as conn:
+        if not await conn.run_sync(create_search_index):
+            print("Chat search is not available for this database")
+            return
+        count = await conn.run_sync(rebuild_search_index)
+    await engine.dispose()
+    print(f"Indexed {count} messages")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""
+Tune a model's thread count and prompt batch size for this host:
+
+    python -m benchmarks.autotune --model mistral-7b
+
+Loads the real model once, then for every thread count up to the number of
+physical cores and every batch size measures prompt-evaluation and decode
+tokens per second on a fixed set of prompts. The settings that answer a
+typical request fastest are written under this host's name to
+MODEL_TUNING_FILE, which the app applies to MODELS_CONFIG when it starts.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Prompt batch sizes tried; prompts are evaluated in INFERENCE_PREFILL_CHUNK
+# token steps, so larger batches than that make no difference
+BATCH_SIZES = [8, 16, 32, 64, 128, 256, 512]
+
+# Conversations behind the fixed prompt set: a first question, a short and a
+# longer follow-up
+PROMPT_CONVERSATIONS = [
+    ([], "What is the difference between a process and a thread?"),
+    (
+        [("Can you suggest a name for a hiking club?", "How about \"Summit Seekers\"? It's short and upbeat.")],
+        "Something less generic, please. The club meets in the Alps."
+    ),
+    (
+        [
+            (
+                "I'm writing a report on the history of the printing press. " * 4,
+                "Gutenberg's press, built around 1440, combined movable metal type, oil-based ink "
+                "and a screw press adapted from wine making. " * 6
+            ),
+            (
+                "How did it spread across Europe?",
+                "Printers trained in Mainz set up shops in Italy, France and the Low Countries; "
+                "by 1500 more than 250 towns had a press. " * 4
+            )
+        ],
+        "Summarize its effect on the Reformation in a few paragraphs."
+    )
+]
+
+def physical_cores() -> int:
+    """Physical CPU cores, which is what matrix code scales with; logical
+    CPUs where /proc/cpuinfo doesn't say"""
+    try:
+        cores = set()
+        physical_id = core_id = None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                elif not key and core_id is not None:
+                    cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+        if cores:
+            return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+def thread_candidates(cores: int) -> List[int]:
+    """Powers of two up to the core count, plus half and all of the cores"""
+    candidates = {cores, max(1, cores // 2)}
+    threads = 1
+    while threads < cores:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+def build_prompts(model) -> List[List[int]]:
+    from app.services.context import format_prompt, format_turn
+
+    return [
+        model.tokenize(format_prompt([format_turn(user, assistant) for user, assistant in turns], message))
+        for turns, message in PROMPT_CONVERSATIONS
+    ]
+
+def measure(
+    model,
+    prompts: List[List[int]],
+    threads: int,
+    batch_size: int,
+    prefill_chunk: int,
+    decode_tokens: int,
+    repeat: int
+) -> Tuple[float, float]:
+    """Prompt-eval and decode tokens per second, the best of `repeat` runs"""
+    best_prompt = best_decode = 0.0
+    for _ in range(repeat):
+        prompt_tokens = decode_steps = 0
+        prompt_seconds = decode_seconds = 0.0
+        for tokens in prompts:
+            model.reset()
+            # Evaluated in the same steps as generate_tokens does
+            started = time.perf_counter()
+            for start in range(0, len(tokens), prefill_chunk):
+                model.eval(tokens[start:start + prefill_chunk], batch_size=batch_size, threads=threads)
+            prompt_seconds += time.perf_counter() - started
+            prompt_tokens += len(tokens)
+
+            started = time.perf_counter()
+            for _ in range(decode_tokens):
+                token = model.sample(top_k=1)
+                model.eval([token], threads=threads)
+            decode_seconds += time.perf_counter() - started
+            decode_steps += decode_tokens
+        best_prompt = max(best_prompt, prompt_tokens / prompt_seconds)
+        best_decode = max(best_decode, decode_steps / decode_seconds)
+    return best_prompt, best_decode
+
+def write_tuning(path: str, host: str, model_name: str, tuned: Dict):
+    """Merge a model's tuned settings into the tuning file, atomically"""
+    from app.config import read_model_tuning
+
+    hosts = read_model_tuning(path)
+    hosts.setdefault(host, {})[model_name] = tuned
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump({"hosts": hosts}, f, indent=2)
+    os.replace(temporary, path)
+
+def parse_list(value: Optional[str]) -> Optional[List[int]]:
+    return [int(item) for item in value.split(",")] if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune threads and batch size of a model for this host")
+    parser.add_argument("--model", default=None, help="model id (default: DEFAULT_MODEL)")
+    parser.add_argument("--threads", default=None, help="comma-separated thread counts to try")
+    parser.add_argument("--batch-sizes", default=None, help="comma-separated batch sizes to try")
+    parser.add_argument("--decode-tokens", type=int, default=32, help="tokens generated per prompt")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--output", default=None, help="tuning file (default: MODEL_TUNING_FILE)")
+    parser.add_argument("--dry-run", action="store_true", help="measure only, don't write the file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    from app.config import settings
+    from app.services.llm import create_model
+
+    model_name = args.model or settings.DEFAULT_MODEL
+    if model_name not in settings.MODELS_CONFIG:
+        parser.error(f"Unknown model {model_name}")
+    output = args.output or settings.MODEL_TUNING_FILE
+    if not output and not args.dry_run:
+        parser.error("MODEL_TUNING_FILE is empty; pass --output or --dry-run")
+    prefill_chunk = settings.INFERENCE_PREFILL_CHUNK
+
+    cores = physical_cores()
+    threads_list = parse_list(args.threads) or thread_candidates(cores)
+    batch_sizes = parse_list(args.batch_sizes) or [size for size in BATCH_SIZES if size <= max(8, prefill_chunk)]
+    print(f"{platform.processor() or platform.machine()}, {cores} physical cores, {os.cpu_count()} logical")
+
+    model = create_model(settings.MODELS_CONFIG[model_name])
+    prompts = build_prompts(model)
+    mean_prompt_tokens = sum(len(tokens) for tokens in prompts) / len(prompts)
+
+    # Score by the time a typical request takes: its prompt plus its answer
+    results = []
+    print(f"{'threads':>7} {'batch':>5} {'prompt tok/s':>12} {'decode tok/s':>12} {'request s':>9}")
+    for threads in threads_list:
+        for batch_size in batch_sizes:
+            prompt_rate, decode_rate = measure(
+                model, prompts, threads, batch_size, prefill_chunk, args.decode_tokens, args.repeat
+            )
+            seconds = mean_prompt_tokens / prompt_rate + args.decode_tokens / decode_rate
+            results.append((seconds, threads, batch_size, prompt_rate, decode_rate))
+            print(f"{threads:>7} {batch_size:>5} {prompt_rate:>12.1f} {decode_rate:>12.1f} {seconds:>9.3f}")
+
+    seconds, threads, batch_size, prompt_rate, decode_rate = min(results)
+    print(f"Best for {model_name}: threads={threads}, batch_size={batch_size}")
+    if args.dry_run:
+        return
+
+    host = socket.gethostname()
+    write_tuning(output, host, model_name, {
+        "threads": threads,
+        "batch_size": batch_size,
+        "prompt_tokens_per_second": round(prompt_rate, 1),
+        "decode_tokens_per_second": round(decode_rate, 1),
+        "physical_cores": cores,
+        "tuned_at": time.time()
+    })
+    print(f"Written to {output} for host {host}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare two benchmark result files written by benchmarks.run:
+
+    python -m benchmarks.compare baseline.json candidate.json
+
+Prints the relative change of throughput and latency percentiles per
+scenario and of the micro-benchmarks. Exits with status 1 when any p95 or
+micro-benchmark regresses by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+def change(old: float, new: float) -> float:
+    if not old:
+        return 0.0
+    return (new - old) / old * 100
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{baseline['meta']['commit']} -> {candidate['meta']['commit']}")
+    regressions = []
+
+    print(f"{'scenario':<16} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, new in candidate.get("load", {}).items():
+        old = baseline.get("load", {}).get(name)
+        if not old:
+            continue
+        deltas = {key: change(old[key], new[key]) for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")}
+        print(f"{name:<16} {deltas['throughput_rps']:>+8.1f}% {deltas['p50_ms']:>+8.1f}% "
+              f"{deltas['p95_ms']:>+8.1f}% {deltas['p99_ms']:>+8.1f}%")
+        if deltas["p95_ms"] > args.threshold:
+            regressions.append(f"{name} p95")
+
+    for name, new in candidate.get("micro", {}).items():
+        old = baseline.get("micro", {}).get(name)
+        if not old:
+            continue
+        delta = change(old["us_per_call"], new["us_per_call"])
+        print(f"{name:<20} {old['us_per_call']:>10.3f} -> {new['us_per_call']:>10.3f} us/call ({delta:+.1f}%)")
+        if delta > args.threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"Regressions over {args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
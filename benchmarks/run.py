@@ -0,0 +1,274 @@
+"""
+Benchmark suite for the API with a stub model backend.
+
+Starts the real FastAPI app on a local port with a fresh SQLite database and
+a deterministic stub model, drives it concurrently through registration,
+login, chat and listing requests, runs a few micro-benchmarks of hot code
+paths, and writes the results as JSON for comparing commits:
+
+    python -m benchmarks.run --users 20 --messages 5 --concurrency 8 --output bench.json
+    python -m benchmarks.compare old.json bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from typing import Any, Awaitable, Callable, Dict, List
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize(latencies: List[float], statuses: Dict[str, int], duration: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": sum(n for status, n in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(count / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if count else 0.0
+    }
+
+async def run_scenario(
+    name: str,
+    jobs: List[Callable[[], Awaitable[Any]]],
+    concurrency: int
+) -> Dict[str, Any]:
+    """Run jobs with at most `concurrency` in flight; each returns an httpx response"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def worker():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await job()
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    result = summarize(latencies, statuses, time.perf_counter() - start)
+    print(f"{name:<16} {result['requests']:>6} req {result['throughput_rps']:>9.2f} rps "
+          f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+          f"p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}")
+    return result
+
+async def run_load(args, base_url: str) -> Dict[str, Any]:
+    import httpx
+
+    # httpx logs every request at INFO, which would bury the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        users = [f"bench{i}" for i in range(args.users)]
+        tokens: Dict[str, str] = {}
+        chats: Dict[str, List[int]] = {user: [] for user in users}
+
+        def register(user):
+            async def job():
+                response = await client.post("/auth/register", json={
+                    "username": user, "email": f"{user}@bench.local", "password": "bench-password"
+                })
+                if response.status_code == 200:
+                    tokens[user] = response.json()["access_token"]
+                return response
+            return job
+
+        def login(user):
+            async def job():
+                response = await client.post("/auth/token", data={"username": user, "password": "bench-password"})
+                if response.status_code == 200:
+                    tokens[user] = response.json()["access_token"]
+                return response
+            return job
+
+        def headers(user):
+            return {"Authorization": f"Bearer {tokens.get(user, '')}"}
+
+        def chat(user, turn):
+            async def job():
+                chat_ids = chats[user]
+                response = await client.post("/api/chat", headers=headers(user), json={
+                    "message": f"Benchmark question {turn} from {user}",
+                    "model": args.model,
+                    "chat_id": chat_ids[0] if chat_ids else None
+                })
+                if response.status_code == 200 and not chat_ids:
+                    chat_ids.append(response.json()["chat_id"])
+                return response
+            return job
+
+        def list_chats(user):
+            return lambda: client.get("/api/chats", headers=headers(user))
+
+        def list_messages(user):
+            chat_id = chats[user][0] if chats[user] else 0
+            return lambda: client.get(f"/api/chats/{chat_id}/messages", headers=headers(user))
+
+        results["register"] = await run_scenario("register", [register(u) for u in users], args.concurrency)
+        results["login"] = await run_scenario("login", [login(u) for u in users], args.concurrency)
+
+        # Each user's first message creates their chat, the rest are follow-ups
+        results["chat_first"] = await run_scenario("chat_first", [chat(u, 0) for u in users], args.concurrency)
+        results["chat_followup"] = await run_scenario(
+            "chat_followup",
+            [chat(u, turn) for turn in range(1, args.messages) for u in users],
+            args.concurrency
+        )
+
+        repeat = max(1, args.list_repeat)
+        results["list_chats"] = await run_scenario(
+            "list_chats", [list_chats(u) for _ in range(repeat) for u in users], args.concurrency
+        )
+        results["list_messages"] = await run_scenario(
+            "list_messages", [list_messages(u) for _ in range(repeat) for u in users], args.concurrency
+        )
+    return results
+
+def run_micro(number: int) -> Dict[str, Any]:
+    """Time hot in-process code paths, in microseconds per call"""
+    from datetime import datetime
+    from app.services.context import build_prompt
+    from app.services.metrics import Histogram
+    from app.services.response_cache import ResponseCache
+    from app.services.chat import encode_cursor, decode_cursor
+
+    history = [
+        {"user_message": f"question {i} " * 20, "assistant_response": f"answer {i} " * 60, "token_count": None}
+        for i in range(32)
+    ]
+    histogram = Histogram("bench_seconds", "benchmark", ["model"])
+    cache = ResponseCache(enabled=True, max_entries=256, ttl_seconds=3600)
+    cursor = encode_cursor(datetime.utcnow(), 12345)
+
+    cases = {
+        # Fresh copies so token counts are computed every time, as on a cold chat
+        "build_prompt_cold": lambda: build_prompt(
+            "next question", [dict(m) for m in history], lambda text: len(text) // 4, 1536
+        ),
+        "response_cache_key": lambda: cache.make_key("mistral-7b", "prompt " * 200, {"temperature": 0}),
+        "histogram_observe": lambda: histogram.observe(0.123, model="mistral-7b"),
+        "cursor_roundtrip": lambda: decode_cursor(cursor)
+    }
+    results = {}
+    for name, fn in cases.items():
+        seconds = min(timeit.repeat(fn, number=number, repeat=3))
+        results[name] = {"us_per_call": round(seconds / number * 1e6, 3), "calls": number}
+        print(f"{name:<20} {results[name]['us_per_call']:>10.3f} us/call")
+    return results
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def run_server_and_load(args) -> Dict[str, Any]:
+    import uvicorn
+    from app.main import app
+    from benchmarks.stub_model import install_stub_model
+
+    install_stub_model({
+        "tokens_per_second": args.tokens_per_second,
+        "prompt_eval_ms": args.prompt_eval_ms,
+        "response": args.response
+    })
+
+    port = free_port()
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            server_task.result()
+        await asyncio.sleep(0.05)
+
+    try:
+        return await run_load(args, f"http://127.0.0.1:{port}")
+    finally:
+        server.should_exit = True
+        await server_task
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API with a stub model")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="chat messages per user")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--list-repeat", type=int, default=5, help="listing requests per user")
+    parser.add_argument("--model", default="mistral-7b")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="stub decode speed")
+    parser.add_argument("--prompt-eval-ms", type=float, default=0.05, help="stub cost per prompt token")
+    parser.add_argument("--response", default="This is a deterministic benchmark response from the stub model.")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="override PASSWORD_HASH_ROUNDS")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--micro-number", type=int, default=2000)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    # Settings are read at import, so configure the environment first
+    workdir = tempfile.mkdtemp(prefix="lemtosh-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["MODEL_STATUS_DB"] = ""
+    os.environ["MODEL_HOST_SOCKET"] = ""
+    os.environ.setdefault("ENVIRONMENT", "development")
+    if args.bcrypt_rounds is not None:
+        os.environ["PASSWORD_HASH_ROUNDS"] = str(args.bcrypt_rounds)
+    sys.path.insert(0, os.getcwd())
+
+    print(f"Load test: {args.users} users, {args.messages} messages each, concurrency {args.concurrency}")
+    load = asyncio.run(run_server_and_load(args))
+    micro = {} if args.skip_micro else run_micro(args.micro_number)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": vars(args)
+        },
+        "load": load,
+        "micro": micro
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import time
+from typing import Dict, List
+
+class StubModel:
+    """Deterministic stand-in for a ctransformers model.
+
+    Implements the token-level API the LLM service uses. Tokens are bytes of
+    the UTF-8 text, prompt evaluation costs prompt_eval_seconds per token and
+    every generated token takes 1 / tokens_per_second, so generation timing
+    is realistic without the real weights.
+    """
+
+    def __init__(self, tokens_per_second: float, prompt_eval_seconds: float, response: str):
+        self.token_seconds = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.prompt_eval_seconds = prompt_eval_seconds
+        self.response = list(response.encode())
+        self._context: List[int] = []
+        self._position = 0
+        self._sampled = False
+
+    def tokenize(self, text: str, add_bos_token: bool = True) -> List[int]:
+        return list(text.encode())
+
+    def detokenize(self, tokens: List[int], decode: bool = True):
+        data = bytes(tokens)
+        return data.decode(errors="ignore") if decode else data
+
+    def prepare_inputs_for_generation(self, tokens: List[int], reset: bool = True) -> List[int]:
+        # Same prefix reuse as ctransformers: keep at least one token to evaluate
+        limit = min(len(tokens) - 1, len(self._context))
+        prefix = 0
+        while prefix < limit and tokens[prefix] == self._context[prefix]:
+            prefix += 1
+        self._context = self._context[:prefix]
+        self._position = 0
+        return tokens[prefix:]
+
+    def eval(self, tokens: List[int], batch_size: int = None, threads: int = None):
+        # Evaluating a just-sampled token is part of the decode step
+        if not self._sampled:
+            time.sleep(self.prompt_eval_seconds * len(tokens))
+        self._sampled = False
+        self._context.extend(tokens)
+
+    def sample(self, **sampling) -> int:
+        time.sleep(self.token_seconds)
+        self._sampled = True
+        if self._position >= len(self.response):
+            return 0
+        token = self.response[self._position]
+        self._position += 1
+        return token
+
+    def is_eos_token(self, token: int) -> bool:
+        return token == 0
+
+    def __call__(self, prompt: str, **kwargs) -> str:
+        return bytes(self.response).decode(errors="ignore")
+
+def install_stub_model(options: Dict):
+    """Make the LLM service load StubModels instead of GGUF files"""
+    from app.config import settings
+    from app.services import llm
+    from app.services.llm import llm_service
+
+    def create_stub(model_config: Dict = None):
+        return StubModel(
+            tokens_per_second=options["tokens_per_second"],
+            prompt_eval_seconds=options["prompt_eval_ms"] / 1000,
+            response=options["response"]
+        )
+
+    for config in settings.MODELS_CONFIG.values():
+        # Keeps the registry from sizing the (missing) model files
+        config["memory_gb"] = 0.01
+    llm.create_model = create_stub
+    llm_service.registry.loader = lambda model_name, model_config: create_stub(model_config)
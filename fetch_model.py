@@ -0,0 +1,88 @@
+"""
+Download model files from the download_url in MODELS_CONFIG:
+
+    python fetch_model.py mistral-7b
+    python fetch_model.py --all --connections 8 --prewarm
+    python fetch_model.py mistral-7b --url http://localhost:8080/mistral.gguf --sha256 <hex>
+
+Interrupted downloads resume when run again.
+"""
+import argparse
+import sys
+import time
+
+from app.config import settings
+from app.services.model_download import DownloadError, ModelDownloader, fetch_model, file_sha256, prewarm
+
+class ProgressPrinter:
+    """Prints download progress about once a second"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.printed = 0.0
+
+    def __call__(self, done: int, total):
+        now = time.monotonic()
+        if now - self.printed < 1 and done != total:
+            return
+        self.printed = now
+        rate = done / max(now - self.started, 1e-6) / 1024 ** 2
+        percent = f"{done / total * 100:5.1f}%" if total else "     "
+        print(f"\r  {percent} {done / 1024 ** 3:7.2f} GB  {rate:7.1f} MB/s", end="", file=sys.stderr, flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Download model files")
+    parser.add_argument("models", nargs="*", help="model ids")
+    parser.add_argument("--all", action="store_true", help="every model available in this environment")
+    parser.add_argument("--connections", type=int, default=settings.MODEL_DOWNLOAD_CONNECTIONS)
+    parser.add_argument("--chunk-mb", type=float, default=settings.MODEL_DOWNLOAD_CHUNK_MB)
+    parser.add_argument("--url", help="download from here instead of the config's download_url")
+    parser.add_argument("--sha256", help="expected SHA-256, overriding the config's")
+    parser.add_argument("--force", action="store_true", help="download even if the file exists")
+    parser.add_argument("--verify", action="store_true", help="check the SHA-256 of existing files")
+    parser.add_argument("--prewarm", action="store_true", help="read the files into the page cache afterwards")
+    args = parser.parse_args()
+
+    model_ids = list(settings.get_available_models()) if args.all else args.models
+    if not model_ids:
+        parser.error("name at least one model, or pass --all")
+    if (args.url or args.sha256) and len(model_ids) != 1:
+        parser.error("--url and --sha256 apply to a single model")
+
+    downloader = ModelDownloader(
+        connections=args.connections,
+        chunk_bytes=int(args.chunk_mb * 1024 ** 2),
+        timeout=settings.MODEL_DOWNLOAD_TIMEOUT,
+        retries=settings.MODEL_DOWNLOAD_RETRIES
+    )
+    failed = False
+    for model_id in model_ids:
+        config = settings.MODELS_CONFIG.get(model_id)
+        if config is None:
+            print(f"{model_id}: unknown model", file=sys.stderr)
+            failed = True
+            continue
+        # Overrides only affect this run
+        if args.url:
+            config["download_url"] = args.url
+        if args.sha256:
+            config["sha256"] = args.sha256
+
+        print(f"{model_id}: {config['path']}")
+        try:
+            path = fetch_model(model_id, downloader, force=args.force, progress=ProgressPrinter())
+            print(file=sys.stderr)
+            if args.verify and config.get("sha256"):
+                if file_sha256(path) != config["sha256"].lower():
+                    raise DownloadError(f"{path} doesn't match its SHA-256")
+                print("  SHA-256 verified")
+            if args.prewarm:
+                print(f"  prewarmed in {prewarm(path):.1f}s")
+        except (DownloadError, OSError) as e:
+            print(f"\n{model_id}: {e}", file=sys.stderr)
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
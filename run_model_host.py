@@ -0,0 +1,5 @@
+from app.config import settings
+from app.services.model_host import run_model_host
+
+if __name__ == "__main__":
+    run_model_host(settings.MODEL_HOST_SOCKET or "/tmp/lemtosh-models.sock")
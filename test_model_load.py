@@ -2,11 +2,15 @@
 This is a test script to verify model loading outside of the multiprocessing context.
 Run this directly to test model loading.
 """
-from ctransformers import AutoModelForCausalLM
 import os
 
+from app.config import settings
+from app.services.llm import create_model
+
 def test_load():
-    model_path = "models/mistral-7b-instruct-v0.1.Q4_K_M.gguf"
+    # Same settings as the app, including this host's tuned threads and batch size
+    model_config = settings.MODELS_CONFIG[settings.DEFAULT_MODEL]
+    model_path = model_config["path"]
     
     print(f"Current working directory: {os.getcwd()}")
     print(f"Testing model load from: {model_path}")
@@ -16,14 +20,8 @@ def test_load():
     
     try:
         print("Attempting to load model...")
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            model_type="mistral",
-            context_length=2048,
-            gpu_layers=0,
-            batch_size=1,
-            threads=6
-        )
+        print(f"Threads: {model_config.get('threads', 'auto')}, batch size: {model_config.get('batch_size', 'default')}")
+        model = create_model(model_config)
         print("Model loaded successfully!")
         
         # Test inference
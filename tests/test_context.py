@@ -0,0 +1,23 @@
+"""Prompt building within the context window"""
+import pytest
+
+from app.services.context import PromptTooLong, build_prompt, format_prompt
+
+def count_tokens(text):
+    return len(text.encode())
+
+def test_drops_oldest_history_first():
+    history = [
+        {"user_message": f"question {i}", "assistant_response": f"answer {i}", "token_count": None}
+        for i in range(10)
+    ]
+    max_tokens = len(format_prompt([], "new")) + 1 + 3 * 40
+    prompt = build_prompt("new", history, count_tokens, max_tokens)
+
+    assert count_tokens(prompt) + 1 <= max_tokens
+    assert "question 9" in prompt and "question 0" not in prompt
+    assert all(item["token_count"] for item in history[-3:])
+
+def test_message_longer_than_the_context():
+    with pytest.raises(PromptTooLong):
+        build_prompt("x" * 100, [], count_tokens, 50)
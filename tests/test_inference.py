@@ -0,0 +1,151 @@
+"""Scheduling in the inference executor and its fair queue"""
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+from app.services.inference import WAITING, InferenceExecutor, QueueFullError, Share, _FairQueue
+
+@pytest.fixture
+def make_executor():
+    executors = []
+
+    def make(**kwargs):
+        options = {"workers": 1, "max_queue_size": 16, "retry_after": 1, "max_batch_size": 1, "max_wait": 0.0}
+        options.update(kwargs)
+        executor = InferenceExecutor(**options)
+        executors.append(executor)
+        return executor
+
+    yield make
+    for executor in executors:
+        executor.stop()
+
+async def collect(stream):
+    return [item async for item in stream]
+
+async def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+def test_stream_jobs_interleave_round_robin(make_executor):
+    executor = make_executor(max_batch_size=2, max_wait=0.2)
+    steps = []
+
+    def generate(name):
+        for i in range(3):
+            steps.append(f"{name}{i}")
+            yield f"{name}{i}"
+
+    async def run():
+        return await asyncio.gather(
+            collect(executor.stream(generate, "a")),
+            collect(executor.stream(generate, "b"))
+        )
+
+    assert asyncio.run(run()) == [["a0", "a1", "a2"], ["b0", "b1", "b2"]]
+    assert steps == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+def test_waiting_job_does_not_block_others(make_executor):
+    executor = make_executor(max_batch_size=2, max_wait=0.2)
+    released = threading.Event()
+    steps = []
+
+    def blocked():
+        while not released.is_set():
+            yield WAITING
+        steps.append("blocked")
+        yield "blocked"
+
+    def releasing():
+        for i in range(3):
+            steps.append(f"releasing{i}")
+            yield i
+        released.set()
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(
+            collect(executor.stream(blocked)),
+            collect(executor.stream(releasing))
+        ), 5)
+
+    assert asyncio.run(run()) == [["blocked"], [0, 1, 2]]
+    assert steps == ["releasing0", "releasing1", "releasing2", "blocked"]
+
+def test_cancelled_jobs_are_not_started(make_executor):
+    executor = make_executor()
+    release = threading.Event()
+    started = []
+
+    def hold():
+        while not release.is_set():
+            time.sleep(0.001)
+            yield None
+        yield "done"
+
+    def record(name):
+        started.append(name)
+        yield name
+
+    async def run():
+        holding = executor.stream(hold)
+        await wait_until(lambda: executor.stats()["active"] == 1)
+
+        call = executor.submit(started.append, "call")
+        stream = executor.stream(record, "stream")
+        assert executor.queue_depth == 2
+        call.cancel()
+        # Closed before its first item, so it never gets to run
+        await stream.aclose()
+
+        release.set()
+        assert await collect(holding) == ["done"]
+        assert await collect(executor.stream(record, "after")) == ["after"]
+
+    asyncio.run(run())
+    assert started == ["after"]
+    assert executor.stats()["completed"] == 2
+
+def test_queue_full(make_executor):
+    executor = make_executor(max_queue_size=2, retry_after=7)
+    release = threading.Event()
+
+    async def run():
+        executor.submit(release.wait)
+        await wait_until(lambda: executor.stats()["active"] == 1)
+        queued = [executor.submit(time.sleep, 0) for _ in range(2)]
+        with pytest.raises(QueueFullError) as error:
+            executor.submit(time.sleep, 0)
+        assert error.value.retry_after == 7
+        assert error.value.queue_depth == 2
+        release.set()
+        await asyncio.gather(*queued)
+
+    asyncio.run(run())
+    assert executor.stats()["rejected"] == 1
+
+def test_fair_queue_serves_idle_tenant_before_heavy_one():
+    jobs = _FairQueue(maxsize=16)
+    for i in range(5):
+        jobs.put_nowait(f"heavy{i}", Share("heavy", cost=100))
+    jobs.put_nowait("light0", Share("light", cost=10))
+    jobs.put_nowait("light1", Share("light", cost=10))
+
+    order = [jobs.get_nowait() for _ in range(7)]
+    assert order == ["heavy0", "light0", "light1", "heavy1", "heavy2", "heavy3", "heavy4"]
+
+def test_fair_queue_weights_and_shutdown_marker():
+    jobs = _FairQueue(maxsize=4)
+    jobs.put_nowait(None)
+    for i in range(2):
+        jobs.put_nowait(f"a{i}", Share("a", cost=10, weight=2))
+        jobs.put_nowait(f"b{i}", Share("b", cost=10))
+    with pytest.raises(queue.Full):
+        jobs.put_nowait("c", Share("c"))
+
+    # a's jobs advance its tags half as far, and the marker comes last
+    assert [jobs.get_nowait() for _ in range(5)] == ["a0", "b0", "a1", "b1", None]
@@ -0,0 +1,144 @@
+"""ModelDownloader against a local HTTP server that serves byte ranges"""
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from app.services.model_download import DownloadError, ModelDownloader
+
+MIB = 1024 * 1024
+DATA = os.urandom(6 * MIB + 12345)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/redirect":
+            # Like Hugging Face: the redirect to storage names size and hash
+            self.send_response(302)
+            self.send_header("Location", "/model.gguf")
+            self.send_header("X-Linked-Etag", f'"{server.linked_sha256}"')
+            self.send_header("X-Linked-Size", str(len(DATA)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        header = self.headers.get("Range")
+        if not header or not server.ranges:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+
+        start, end = (int(value) for value in header.split("=")[1].split("-"))
+        with server.lock:
+            server.ranges_served.append(start)
+        if start == server.fail_at:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = DATA[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for offset in range(0, len(body), 64 * 1024):
+                self.wfile.write(body[offset:offset + 64 * 1024])
+                # Slow enough that other ranges are mid-transfer when one fails
+                time.sleep(server.delay)
+        except ConnectionError:
+            pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.daemon_threads = True
+    server.ranges = True
+    server.fail_at = None
+    server.delay = 0.0
+    server.linked_sha256 = SHA256
+    server.ranges_served = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def downloader(retries=0):
+    return ModelDownloader(connections=4, chunk_bytes=MIB, timeout=5, retries=retries)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_parallel_download(server, tmp_path):
+    destination = str(tmp_path / "models" / "model.gguf")
+    downloader().download(f"{server.url}/model.gguf", destination, size=len(DATA), sha256=SHA256)
+
+    assert read(destination) == DATA
+    assert sorted(os.listdir(tmp_path / "models")) == ["model.gguf"]
+    # The probe, then one request per chunk
+    assert len(server.ranges_served) == 1 + 7
+
+def test_resume_after_failure(server, tmp_path):
+    destination = str(tmp_path / "model.gguf")
+    server.fail_at = 4 * MIB
+    server.delay = 0.01
+    with pytest.raises(DownloadError):
+        downloader().download(f"{server.url}/model.gguf", destination, sha256=SHA256)
+    assert not os.path.exists(destination)
+
+    # Only chunks written to the end may be recorded as done
+    with open(f"{destination}.part.json") as f:
+        done = json.load(f)["done"]
+    assert 4 not in done
+    part = read(f"{destination}.part")
+    for index in done:
+        assert part[index * MIB:(index + 1) * MIB] == DATA[index * MIB:(index + 1) * MIB]
+
+    server.fail_at = None
+    server.delay = 0.0
+    server.ranges_served.clear()
+    downloader().download(f"{server.url}/model.gguf", destination, sha256=SHA256)
+    assert read(destination) == DATA
+    assert not os.path.exists(f"{destination}.part.json")
+    # Finished chunks aren't downloaded again
+    assert sorted(server.ranges_served[1:]) == [index * MIB for index in range(7) if index not in done]
+
+def test_sha256_mismatch_deletes_part(server, tmp_path):
+    destination = str(tmp_path / "model.gguf")
+    with pytest.raises(DownloadError, match="SHA-256 mismatch"):
+        downloader().download(f"{server.url}/model.gguf", destination, sha256="0" * 64)
+    assert os.listdir(tmp_path) == []
+
+def test_server_without_ranges(server, tmp_path):
+    server.ranges = False
+    destination = str(tmp_path / "model.gguf")
+    downloader().download(f"{server.url}/model.gguf", destination, sha256=SHA256)
+    assert read(destination) == DATA
+    assert server.ranges_served == []
+
+def test_published_sha256_is_verified(server, tmp_path):
+    destination = str(tmp_path / "model.gguf")
+    downloader().download(f"{server.url}/redirect", destination)
+    assert read(destination) == DATA
+
+    os.unlink(destination)
+    server.linked_sha256 = "0" * 64
+    with pytest.raises(DownloadError, match="SHA-256 mismatch"):
+        downloader().download(f"{server.url}/redirect", destination)
+    assert not os.path.exists(destination)
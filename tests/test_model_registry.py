@@ -0,0 +1,89 @@
+"""Model loading, eviction and waiting in the model registry"""
+import threading
+
+import pytest
+
+from app.config import settings
+from app.services.inference import ResourceBusy
+from app.services.model_registry import ModelRegistry
+from app.services.model_status import ModelStatus
+from benchmarks.stub_model import StubModel
+
+GB = 1024 ** 3
+
+@pytest.fixture(autouse=True)
+def models(monkeypatch):
+    monkeypatch.setattr(settings, "MODELS_CONFIG", {
+        name: {"path": f"{name}.gguf", "memory_gb": memory_gb, "environment": [settings.ENVIRONMENT]}
+        for name, memory_gb in [("a", 1), ("b", 1), ("c", 1), ("huge", 3)]
+    })
+
+def make_registry(budget_gb, loader=None):
+    evicted = []
+    registry = ModelRegistry(
+        loader or (lambda model_id, config: StubModel(0, 0, model_id)),
+        memory_budget_bytes=budget_gb * GB,
+        on_evict=evicted.append
+    )
+    return registry, evicted
+
+def test_least_recently_used_model_is_evicted():
+    registry, evicted = make_registry(2)
+    for model_id in ("a", "b", "a"):
+        with registry.use(model_id):
+            pass
+
+    with registry.use("c"):
+        pass
+
+    assert evicted == ["b"]
+    assert sorted(registry.stats()["loaded"]) == ["a", "c"]
+    assert registry.stats()["memory_used_bytes"] == 2 * GB
+
+def test_model_in_flight_is_not_evicted():
+    registry, evicted = make_registry(1)
+    model_a = registry.acquire("a")
+    with pytest.raises(ResourceBusy):
+        registry.acquire("b", blocking=False)
+    assert evicted == []
+
+    # A blocking acquire waits for the release, then takes the memory
+    loaded = []
+    waiter = threading.Thread(target=lambda: loaded.append(registry.acquire("b")))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    assert registry.get_status("a")["status"] == ModelStatus.READY
+
+    registry.release("a")
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert loaded and loaded[0] is not model_a
+    assert evicted == ["a"]
+    registry.release("b")
+
+def test_model_being_loaded_elsewhere_is_busy():
+    loading = threading.Event()
+    finish = threading.Event()
+
+    def slow_loader(model_id, config):
+        loading.set()
+        finish.wait(5)
+        return StubModel(0, 0, model_id)
+
+    registry, _ = make_registry(2, slow_loader)
+    loader = threading.Thread(target=registry.acquire, args=("a",))
+    loader.start()
+    assert loading.wait(5)
+    with pytest.raises(ResourceBusy):
+        registry.acquire("a", blocking=False)
+
+    finish.set()
+    loader.join(5)
+    with registry.use("a", blocking=False):
+        assert registry.get_status("a")["in_flight"] == 2
+
+def test_model_larger_than_the_budget():
+    registry, _ = make_registry(2)
+    with pytest.raises(ValueError, match="budget"):
+        registry.acquire("huge")
@@ -0,0 +1,110 @@
+"""Checking out per-chat model contexts from the prompt cache"""
+import threading
+
+import pytest
+
+from app.services.inference import ResourceBusy
+from app.services.prompt_cache import PromptCache, estimate_kv_bytes
+from benchmarks.stub_model import StubModel
+
+CONFIG = {"context_length": 64}
+
+def stub():
+    return StubModel(0, 0, "")
+
+def make_cache(extra_contexts):
+    return PromptCache(max_bytes=extra_contexts * estimate_kv_bytes(CONFIG))
+
+def session(cache, chat_id, base, blocking=True):
+    return cache.session("m", chat_id, base, CONFIG, stub, blocking=blocking)
+
+def test_chat_gets_its_context_back():
+    cache = make_cache(1)
+    base = stub()
+    with session(cache, 1, base) as first:
+        assert first is base
+    with session(cache, 2, base) as second:
+        assert second is not base
+    with session(cache, 1, base) as again:
+        assert again is first
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["states"]) == (1, 2, 2)
+
+def test_chat_takes_over_the_least_recently_used_idle_context():
+    cache = make_cache(1)
+    base = stub()
+    with session(cache, 1, base):
+        pass
+    with session(cache, 2, base) as extra:
+        pass
+    with session(cache, 1, base):
+        pass
+
+    # No room for a third context, so chat 2's goes to chat 3
+    with session(cache, 3, base) as taken:
+        assert taken is extra
+    assert cache.stats()["states"] == 2
+    with session(cache, 2, base) as model:
+        assert model is base
+
+def test_chat_waits_for_a_busy_context():
+    cache = make_cache(0)
+    base = stub()
+    holder = session(cache, 1, base)
+    holder.__enter__()
+    with pytest.raises(ResourceBusy):
+        with session(cache, 1, base, blocking=False):
+            pass
+    with pytest.raises(ResourceBusy):
+        with session(cache, 2, base, blocking=False):
+            pass
+
+    got = []
+
+    def wait():
+        with session(cache, 2, base) as model:
+            got.append(model)
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    holder.__exit__(None, None, None)
+    waiter.join(5)
+    assert got == [base]
+
+def test_generation_without_a_chat_checks_out_a_context():
+    cache = make_cache(0)
+    base = stub()
+    with session(cache, 1, base):
+        with pytest.raises(ResourceBusy):
+            with session(cache, None, base, blocking=False):
+                pass
+    with session(cache, None, base) as model:
+        assert model is base
+        with pytest.raises(ResourceBusy):
+            with session(cache, 1, base, blocking=False):
+                pass
+
+def test_failed_context_creation_frees_its_slot():
+    cache = make_cache(1)
+    base = stub()
+
+    def broken():
+        raise RuntimeError("out of memory")
+
+    with session(cache, 1, base):
+        with pytest.raises(RuntimeError):
+            with cache.session("m", 2, base, CONFIG, broken):
+                pass
+        with session(cache, 2, base) as extra:
+            assert extra is not base
+
+def test_dropped_model_forgets_its_contexts():
+    cache = make_cache(1)
+    base = stub()
+    with session(cache, 1, base):
+        pass
+    cache.drop_model("m")
+    assert cache.stats()["states"] == 0